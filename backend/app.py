@@ -1,15 +1,33 @@
+from gevent import monkey
+monkey.patch_all()
+# psycopg2 waits on the gevent loop instead of blocking it, for queries and NOTIFYs alike
+from psycogreen.gevent import patch_psycopg
+patch_psycopg()
+
 import os
 import sys
+import time
+import atexit
+import functools
 import json
 import logging
-from datetime import datetime
+import sqlalchemy
+from datetime import datetime, timedelta
 from flask import Flask, request, Response, make_response, jsonify
-from flask_socketio import SocketIO, emit, join_room, leave_room
+from flask_socketio import SocketIO, ConnectionRefusedError, emit, leave_room
 from flask_cors import CORS
-from google.oauth2 import id_token
-from google.auth.transport import requests
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects import postgresql, sqlite
 from geventwebsocket.websocket import WebSocket
+from engineio import packet as eio_packet
+from socketio import packet as socketio_packet
+from game_engine import RoundEngine, WriteBehind, GameError
+from message_queue import make_client_manager, SHARD_KEY_LENGTH
+from auth import GoogleTokenVerifier, SessionTokens, GOOGLE_CERTS_URL
+from presence import Presence, Inbox, normalize_email
+from telemetry import configure_logging, Metrics, SamplingFilter
+from stats import pair_key, recompute_totals, summary, user_totals, z_score
+from backpressure import RateLimiter, Outbox, parse_limits, DEFAULT_RATE_LIMITS
 
 class JSONEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -20,18 +38,43 @@ class JSONEncoder(json.JSONEncoder):
         except:
             return str(obj)
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging; writes happen on a background thread
+configure_logging(os.getenv('LOG_LEVEL', 'INFO'))
 logger = logging.getLogger(__name__)
+# Per-event logs fire on every socket event, so only one in LOG_SAMPLE_EVERY is kept
+event_logger = logging.getLogger(f'{__name__}.events')
+event_logger.addFilter(SamplingFilter(int(os.getenv('LOG_SAMPLE_EVERY', '1'))))
+metrics = Metrics()
 
 app = Flask(__name__)
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'default_secret_key')
+app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
+if not app.config['SECRET_KEY']:
+    # It signs the session tokens Socket.IO trusts; a known default would let anyone mint one
+    raise RuntimeError('SECRET_KEY must be set')
 
 # Configure database
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 logger.info('Database configured with Supabase PostgreSQL')
 
+# Google sign-in is verified once per login; sockets then use our own session token
+verifier = GoogleTokenVerifier(
+    os.getenv('GOOGLE_CLIENT_ID'),
+    certs_url=os.getenv('GOOGLE_CERTS_URL', GOOGLE_CERTS_URL)
+)
+session_tokens = SessionTokens(app.config['SECRET_KEY'])
+
+# Authenticated connections in this process, and invitations for offline users
+presence = Presence()
+# A pending game expires after GAME_PENDING_TTL, so invitations are never held longer than that
+GAME_PENDING_TTL = int(os.getenv('GAME_PENDING_TTL', 3600))
+inbox = Inbox(ttl=min(int(os.getenv('INVITATION_TTL', 24 * 3600)), GAME_PENDING_TTL))
+
+# Token buckets per connection and per user, as event=rate/burst pairs; see backpressure.py
+rate_limits = parse_limits(os.getenv('RATE_LIMITS', DEFAULT_RATE_LIMITS))
+connection_limits = RateLimiter(rate_limits)
+user_limits = RateLimiter(rate_limits)
+
 # Configure CORS
 CORS(app, resources={
     r"/*": {
@@ -55,52 +98,109 @@ def after_request(response):
         response.headers.add('Cross-Origin-Opener-Policy', 'same-origin-allow-popups')
     return response
 
-# Configure SocketIO with enhanced WebSocket support
+# Optional message queue shared by every worker and instance
+message_queue_url = os.getenv('SOCKETIO_MESSAGE_QUEUE')
+client_manager = make_client_manager(message_queue_url) if message_queue_url else None
+
+# Configure SocketIO; clients connect over websocket first and fall back to
+# polling, and packets are MessagePack-encoded unless SOCKETIO_SERIALIZER=default
 socketio = SocketIO(
     app,
     cors_allowed_origins="*",
     async_mode='gevent',
-    logger=True,
-    engineio_logger=True,
+    logger=os.getenv('SOCKETIO_LOGGING') == '1',
+    engineio_logger=os.getenv('SOCKETIO_LOGGING') == '1',
     ping_timeout=60000,
     ping_interval=25000,
-    transports=['polling', 'websocket'],
-    always_connect=True,
+    transports=['websocket', 'polling'],
+    always_connect=False,
     path='/socket.io',
     cookie=False,
     manage_session=False,
     allow_upgrades=True,
-    max_http_buffer_size=1e8,
+    max_http_buffer_size=int(os.getenv('MAX_PACKET_BYTES', 16 * 1024)),
+    serializer=os.getenv('SOCKETIO_SERIALIZER', 'msgpack'),
     handle_session=False,
-    cors_credentials=False
+    cors_credentials=False,
+    client_manager=client_manager
 )
 
-logger.info(f"Starting application with DATABASE_URL: {app.config['SQLALCHEMY_DATABASE_URI']}")
+def eio_backlog(eio_sid):
+    """Packets waiting to be picked up by a client, or None once it has gone."""
+    socket = socketio.server.eio.sockets.get(eio_sid)
+    if socket is None or socket.closed:
+        return None
+    return socket.queue.qsize()
+
+def describe_eio_packet(eio_pkt):
+    """The (event, data) of a Socket.IO event in an Engine.IO message, or None for anything else."""
+    if eio_pkt.packet_type != eio_packet.MESSAGE:
+        return None
+    if isinstance(eio_pkt.data, bytes) and socketio.server.packet_class is socketio_packet.Packet:
+        # A binary attachment of the JSON protocol, which must stay behind its header
+        return None
+    try:
+        pkt = socketio.server.packet_class(encoded_packet=eio_pkt.data)
+    except Exception:
+        return None
+    if pkt.packet_type != socketio_packet.EVENT or not pkt.data:
+        return None
+    return pkt.data[0], pkt.data[1] if len(pkt.data) > 1 else None
+
+# Every emit without a callback reaches clients through _send_eio_packet, already encoded;
+# hold updates for clients that fall behind, decoding a packet only when it is held
+def disconnect_lagging(eio_sid):
+    """Close a connection too far behind to be sent its one-time events; the client reconnects."""
+    logger.warning("Disconnecting %s: more than OUTBOX_MAX_HELD events waiting", eio_sid)
+    # Called from inside an emit, so the socket is closed once that emit is done
+    socketio.start_background_task(socketio.server.eio.disconnect, eio_sid)
+
+outbox = Outbox(socketio.server._send_eio_packet, eio_backlog, describe_eio_packet,
+                max_backlog=int(os.getenv('OUTBOX_MAX_BACKLOG', 32)),
+                max_held=int(os.getenv('OUTBOX_MAX_HELD', 16)),
+                on_overflow=disconnect_lagging)
+socketio.server._send_eio_packet = outbox.send
+
+logger.info("Starting application")
 
 db = SQLAlchemy(app)
 
+def count_query(*args):
+    metrics.count('db.queries')
+
+with app.app_context():
+    sqlalchemy.event.listen(db.engine, 'before_cursor_execute', count_query)
+
 @app.route('/health')
 def health_check():
-    logger.info("Health check endpoint called")
-    logger.debug(f"Request headers: {dict(request.headers)}")
-    logger.debug(f"Request method: {request.method}")
-    logger.debug(f"Request path: {request.path}")
-    response = jsonify({
+    return jsonify({
         "status": "healthy",
-        "timestamp": datetime.utcnow().isoformat(),
-        "request_info": {
-            "method": request.method,
-            "path": request.path,
-            "headers": dict(request.headers)
-        }
+        "timestamp": datetime.utcnow().isoformat()
     })
-    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return jsonify(metrics.snapshot())
 
 class Game(db.Model):
+    id = db.Column(db.String(50), primary_key=True)
+    sender_id = db.Column(db.String(100), nullable=False, index=True)
+    receiver_id = db.Column(db.String(100), nullable=True, index=True)
+    status = db.Column(db.String(20), default='pending')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Serves lookups by status and the reaper's status + age range scans; id makes the
+    # reaper's (updated_at, id) batches a covering range read in index order
+    __table_args__ = (db.Index('ix_game_status_updated_at_id', 'status', 'updated_at', 'id'),)
+
+# Finished and expired games, moved out of the game table by the reaper
+class GameArchive(db.Model):
+    __tablename__ = 'game_archive'
     id = db.Column(db.String(50), primary_key=True)
     sender_id = db.Column(db.String(100), nullable=False)
     receiver_id = db.Column(db.String(100), nullable=True)
-    status = db.Column(db.String(20), default='pending')
+    status = db.Column(db.String(20), nullable=False)
+    updated_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -108,7 +208,439 @@ class User(db.Model):
     email = db.Column(db.String(100), unique=True, nullable=False)
     name = db.Column(db.String(100), nullable=False)
 
+class Round(db.Model):
+    __tablename__ = 'rounds'
+    id = db.Column(db.Integer, primary_key=True)
+    # Not a foreign key: the game may have moved to game_archive
+    game_id = db.Column(db.String(50), nullable=False, index=True)
+    round_number = db.Column(db.SmallInteger, nullable=False)
+    sender_card = db.Column(db.SmallInteger, nullable=False)
+    receiver_card = db.Column(db.SmallInteger, nullable=False)
+    is_correct = db.Column(db.Boolean, nullable=False)
+    finished_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+LEADERBOARD_MIN_ROUNDS = int(os.getenv('LEADERBOARD_MIN_ROUNDS', 20))
+# Rendered as a literal so the planner can match it to the partial index below
+LEADERBOARD_WHERE = sqlalchemy.text(f'rounds >= {LEADERBOARD_MIN_ROUNDS}')
+
+# Running totals, only ever added to by persist_batch; see stats.py
+class UserStats(db.Model):
+    __tablename__ = 'user_stats'
+    user_id = db.Column(db.String(100), primary_key=True)
+    games = db.Column(db.Integer, nullable=False, default=0)
+    rounds = db.Column(db.Integer, nullable=False, default=0)
+    hits = db.Column(db.Integer, nullable=False, default=0)
+    z_score = db.Column(db.Float, nullable=False, default=0.0)
+    # Holds only users with enough rounds to rank, named after the threshold so changing it builds a new one
+    __table_args__ = (db.Index(f'ix_user_stats_leaderboard_{LEADERBOARD_MIN_ROUNDS}', 'z_score', 'user_id',
+                               postgresql_where=LEADERBOARD_WHERE, sqlite_where=LEADERBOARD_WHERE),)
+
+class PairStats(db.Model):
+    __tablename__ = 'pair_stats'
+    # Stored once per pair, with user_a < user_b
+    user_a = db.Column(db.String(100), primary_key=True)
+    user_b = db.Column(db.String(100), primary_key=True)
+    games = db.Column(db.Integer, nullable=False, default=0)
+    rounds = db.Column(db.Integer, nullable=False, default=0)
+    hits = db.Column(db.Integer, nullable=False, default=0)
+    z_score = db.Column(db.Float, nullable=False, default=0.0)
+
+# One row per player of each finished game, so a user's history is one index range
+class GameResult(db.Model):
+    __tablename__ = 'game_results'
+    user_id = db.Column(db.String(100), primary_key=True)
+    game_id = db.Column(db.String(50), primary_key=True)
+    partner_id = db.Column(db.String(100), nullable=False)
+    role = db.Column(db.String(10), nullable=False)
+    rounds = db.Column(db.SmallInteger, nullable=False)
+    hits = db.Column(db.SmallInteger, nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=False)
+    __table_args__ = (db.Index('ix_game_results_history', 'user_id', 'finished_at', 'game_id'),)
+
+def dialect_insert(model):
+    """INSERT with the database's ON CONFLICT support (Postgres in production, SQLite locally)."""
+    dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    return dialect.insert(model)
+
+def add_totals(model, totals):
+    """Add {key: (games, rounds, hits)} to ``model``'s rows and refresh their z-scores."""
+    keys = [column.name for column in model.__table__.primary_key]
+    rows = [dict(zip(keys, key if isinstance(key, tuple) else (key,)),
+                 games=games, rounds=rounds, hits=hits)
+            for key, (games, rounds, hits) in totals.items()]
+    insert = dialect_insert(model).values(rows)
+    # Increment in the database so concurrent flushes from several processes add up
+    upsert = insert.on_conflict_do_update(
+        index_elements=keys,
+        set_={name: getattr(model, name) + getattr(insert.excluded, name)
+              for name in ('games', 'rounds', 'hits')}
+    ).returning(*model.__table__.primary_key.columns, model.rounds, model.hits)
+    updated = db.session.execute(upsert).all()
+    db.session.bulk_update_mappings(model, [
+        dict(zip(keys, row[:len(keys)]), z_score=z_score(row.hits, row.rounds))
+        for row in updated
+    ])
+
+@metrics.timed('db.flush')
+def persist_batch(new_games, updated_games, rounds, results, pairs):
+    with app.app_context():
+        try:
+            if new_games:
+                db.session.bulk_insert_mappings(Game, new_games)
+            if updated_games:
+                db.session.bulk_update_mappings(Game, updated_games)
+            if rounds:
+                db.session.bulk_insert_mappings(Round, rounds)
+            if results:
+                db.session.bulk_insert_mappings(GameResult, results)
+            if pairs:
+                add_totals(PairStats, pairs)
+                add_totals(UserStats, user_totals(pairs))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    logger.debug("Flushed %d games and %d rounds", len(new_games) + len(updated_games), len(rounds))
+
+def log_flush_error(e):
+    logger.error("Error flushing game state: %s", e)
+
+def is_row_error(e):
+    """Failures that retrying the same rows cannot fix, unlike a lost connection."""
+    return isinstance(e, (sqlalchemy.exc.IntegrityError, sqlalchemy.exc.DataError,
+                          sqlalchemy.orm.exc.StaleDataError))
+
+def drop_game_rows(game_id, rows, e):
+    metrics.count('write_behind.dropped')
+    logger.error("Dropped unwritable rows of game %s: %s; rows: %r", game_id, e, rows)
+
+write_behind = WriteBehind(persist_batch, interval=float(os.getenv('WRITE_BEHIND_INTERVAL', '1.0')),
+                           max_retries=int(os.getenv('WRITE_BEHIND_RETRIES', 3)),
+                           is_row_error=is_row_error, on_drop=drop_game_rows)
+engine = RoundEngine(write_behind)
+socketio.start_background_task(write_behind.run, socketio.sleep, log_flush_error)
+socketio.start_background_task(inbox.run, socketio.sleep)
+socketio.start_background_task(outbox.run, socketio.sleep)
+socketio.start_background_task(connection_limits.run, socketio.sleep)
+socketio.start_background_task(user_limits.run, socketio.sleep)
+atexit.register(write_behind.flush)
+
+metrics.gauge('connections', lambda: len(presence))
+metrics.gauge('games_in_memory', lambda: len(engine))
+metrics.gauge('write_behind_pending', lambda: len(write_behind))
+metrics.gauge('inboxes', lambda: len(inbox))
+metrics.gauge('rate_limit_buckets', lambda: len(connection_limits) + len(user_limits))
+metrics.gauge('outbox_held', lambda: len(outbox))
+metrics.gauge('outbox_deferred', lambda: outbox.deferred)
+metrics.gauge('outbox_coalesced', lambda: outbox.coalesced)
+metrics.gauge('outbox_dropped', lambda: outbox.dropped)
+metrics.gauge('outbox_overflowed', lambda: outbox.overflowed)
+
+def load_game(game_id):
+    """The live state of a game, loaded from the database if need be.
+
+    Returns None for an unknown id and raises GameError for a game that has ended.
+    """
+    state = engine.get(game_id)
+    if state is not None:
+        return state
+    status = engine.ended(game_id)
+    if status is None:
+        game = Game.query.get(game_id) or GameArchive.query.get(game_id)
+        if game is None:
+            return None
+        if game.status not in ('finished', 'expired'):
+            rounds = db.session.query(Round.sender_card, Round.receiver_card) \
+                .filter_by(game_id=game_id).order_by(Round.round_number).all()
+            return engine.adopt(game.id, game.sender_id, game.receiver_id, game.status, rounds)
+        status = game.status
+        engine.bury(game_id, status)
+    raise GameError(f'Game is {status}')
+
+# Seconds a game may sit idle in each status before the reaper acts on it.
+# Finished games only leave memory; their rows are archived GAME_ARCHIVE_AFTER later.
+GAME_IDLE_LIMITS = {
+    'pending': GAME_PENDING_TTL,
+    'active': int(os.getenv('GAME_ACTIVE_TTL', 1800)),
+    'finished': int(os.getenv('GAME_FINISHED_TTL', 300)),
+}
+GAME_ARCHIVE_AFTER = int(os.getenv('GAME_ARCHIVE_AFTER', 3600))
+REAPER_INTERVAL = float(os.getenv('REAPER_INTERVAL', '60'))
+REAPER_BATCH = 500
+
+def expire_stale_games(status, cutoff, sleep):
+    """Expire games in ``status`` last updated before ``cutoff``, one batch per UPDATE.
+
+    Games this process holds in memory are left to engine.expire: their rows only catch up
+    with the in-memory state on the next write-behind flush.
+    """
+    # Pages in ix_game_status_updated_at_id order, so each batch resumes where the last one ended
+    stale = sqlalchemy.select(Game.updated_at, Game.id) \
+        .where(Game.status == status, Game.updated_at < cutoff) \
+        .order_by(Game.updated_at, Game.id).limit(REAPER_BATCH)
+    position = stale
+    expired = 0
+    while True:
+        rows = db.session.execute(position).all()
+        idle = [game_id for _, game_id in rows if game_id not in engine.games]
+        if idle:
+            # Checked again in the UPDATE, as a flush may have touched them since
+            result = db.session.execute(
+                sqlalchemy.update(Game)
+                .where(Game.id.in_(idle), Game.status == status, Game.updated_at < cutoff)
+                .values(status='expired', updated_at=datetime.utcnow())
+                .execution_options(synchronize_session=False))
+            expired += result.rowcount
+        db.session.commit()
+        if len(rows) < REAPER_BATCH:
+            return expired
+        position = stale.where(sqlalchemy.tuple_(Game.updated_at, Game.id) > tuple(rows[-1]))
+        sleep(0)
+
+def archive_games(cutoff, sleep):
+    """Move finished and expired games last updated before ``cutoff`` to game_archive."""
+    ended = sqlalchemy.select(Game.id) \
+        .where(Game.status.in_(('finished', 'expired')), Game.updated_at < cutoff) \
+        .limit(REAPER_BATCH)
+    columns = (Game.id, Game.sender_id, Game.receiver_id, Game.status, Game.updated_at)
+    archived = 0
+    while True:
+        ids = db.session.execute(ended).scalars().all()
+        if not ids:
+            return archived
+        # Another process's reaper may have archived some of them already
+        db.session.execute(dialect_insert(GameArchive).from_select(
+            [column.name for column in columns] + ['archived_at'],
+            sqlalchemy.select(*columns, sqlalchemy.literal(datetime.utcnow()))
+            .where(Game.id.in_(ids))
+        ).on_conflict_do_nothing())
+        db.session.execute(sqlalchemy.delete(Game).where(Game.id.in_(ids))
+                           .execution_options(synchronize_session=False))
+        db.session.commit()
+        archived += len(ids)
+        if len(ids) < REAPER_BATCH:
+            return archived
+        sleep(0)
+
+@metrics.timed('reaper.pass')
+def reap_games(sleep):
+    """Drop idle games from memory, then expire and archive stale rows in batches."""
+    evicted = engine.expire(time.time(), GAME_IDLE_LIMITS)
+    for game_id in evicted:
+        socketio.close_room(game_id)
+    now = datetime.utcnow()
+    with app.app_context():
+        try:
+            expired = sum(
+                expire_stale_games(status, now - timedelta(seconds=GAME_IDLE_LIMITS[status]), sleep)
+                for status in ('pending', 'active'))
+            archived = archive_games(now - timedelta(seconds=GAME_ARCHIVE_AFTER), sleep)
+        except Exception:
+            db.session.rollback()
+            raise
+    metrics.count('games.evicted', len(evicted))
+    metrics.count('games.expired', expired)
+    metrics.count('games.archived', archived)
+    logger.debug("Reaper evicted %d, expired %d and archived %d games", len(evicted), expired, archived)
+
+def run_reaper(sleep):
+    while True:
+        sleep(REAPER_INTERVAL)
+        try:
+            reap_games(sleep)
+        except Exception as e:
+            logger.error("Error reaping games: %s", e)
+
+socketio.start_background_task(run_reaper, socketio.sleep)
+
+def create_schema():
+    """create_all, plus the columns, indexes and constraint changes it won't make to existing tables."""
+    db.create_all()
+    inspector = sqlalchemy.inspect(db.engine)
+    with db.engine.begin() as conn:
+        if 'updated_at' not in {column['name'] for column in inspector.get_columns('game')}:
+            conn.execute(sqlalchemy.text('ALTER TABLE game ADD COLUMN updated_at TIMESTAMP'))
+            conn.execute(sqlalchemy.update(Game.__table__).values(updated_at=datetime.utcnow()))
+        if conn.dialect.name == 'postgresql':
+            for foreign_key in inspector.get_foreign_keys('rounds'):
+                if foreign_key['referred_table'] == 'game':
+                    conn.execute(sqlalchemy.text(
+                        f'ALTER TABLE rounds DROP CONSTRAINT "{foreign_key["name"]}"'))
+    with db.engine.begin() as conn:
+        # Indexes replaced by a newer definition, such as the reaper's index without id or the
+        # leaderboard's full index or one for an earlier LEADERBOARD_MIN_ROUNDS
+        for model, prefix in ((Game, 'ix_game_status_updated_at'), (UserStats, 'ix_user_stats_leaderboard')):
+            current = {index.name for index in model.__table__.indexes}
+            for index in inspector.get_indexes(model.__table__.name):
+                if index['name'].startswith(prefix) and index['name'] not in current:
+                    conn.execute(sqlalchemy.text(f'DROP INDEX "{index["name"]}"'))
+    for index in list(Game.__table__.indexes) + list(UserStats.__table__.indexes):
+        index.create(db.engine, checkfirst=True)
+
+@app.cli.command('create-schema')
+def create_schema_command():
+    """Create the tables and bring existing ones up to date; run on every deploy."""
+    create_schema()
+    print("Database schema is up to date")
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+def page_size():
+    return max(1, min(request.args.get('limit', PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+
+def stats_summary(row):
+    return summary(row.games, row.rounds, row.hits) if row is not None else summary()
+
+@app.route('/stats/users/<user_id>')
+@metrics.timed('http.user_stats')
+def user_stats(user_id):
+    return jsonify(dict(stats_summary(UserStats.query.get(user_id)), user_id=user_id))
+
+@app.route('/stats/pairs/<user_id>/<partner_id>')
+@metrics.timed('http.pair_stats')
+def pair_stats(user_id, partner_id):
+    row = PairStats.query.get(pair_key(user_id, partner_id))
+    return jsonify(dict(stats_summary(row), user_ids=[user_id, partner_id]))
+
+@app.route('/leaderboard')
+@metrics.timed('http.leaderboard')
+def leaderboard():
+    # Walks the partial leaderboard index from the top; every entry in it qualifies, so the
+    # scan reads one page of rows however many users are below LEADERBOARD_MIN_ROUNDS
+    rows = db.session.query(UserStats, User.name) \
+        .outerjoin(User, User.id == UserStats.user_id) \
+        .filter(UserStats.rounds >= sqlalchemy.literal_column(str(LEADERBOARD_MIN_ROUNDS))) \
+        .order_by(UserStats.z_score.desc(), UserStats.user_id.desc()) \
+        .limit(page_size()).all()
+    return jsonify({
+        'min_rounds': LEADERBOARD_MIN_ROUNDS,
+        'leaders': [dict(stats_summary(row), user_id=row.user_id, name=name)
+                    for row, name in rows]
+    })
+
+@app.route('/users/<user_id>/games')
+@metrics.timed('http.game_history')
+def game_history(user_id):
+    """A user's finished games, newest first.
+
+    Pass a page's ``next_cursor`` as ``before`` to get the next page; each
+    page is one range scan of ix_game_results_history.
+    """
+    query = GameResult.query.filter_by(user_id=user_id)
+    before = request.args.get('before')
+    if before:
+        try:
+            finished_at, game_id = before.split('_', 1)
+            finished_at = datetime.fromisoformat(finished_at)
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        query = query.filter(sqlalchemy.tuple_(GameResult.finished_at, GameResult.game_id)
+                             < (finished_at, game_id))
+    limit = page_size()
+    rows = query.order_by(GameResult.finished_at.desc(), GameResult.game_id.desc()) \
+        .limit(limit + 1).all()
+    page = rows[:limit]
+    return jsonify({
+        'games': [{
+            'game_id': row.game_id,
+            'partner_id': row.partner_id,
+            'role': row.role,
+            'rounds': row.rounds,
+            'hits': row.hits,
+            'finished_at': row.finished_at.isoformat()
+        } for row in page],
+        'next_cursor': f"{page[-1].finished_at.isoformat()}_{page[-1].game_id}"
+        if len(rows) > limit else None
+    })
+
+@app.route('/games/<game_id>')
+@metrics.timed('http.game_detail')
+def game_detail(game_id):
+    state = engine.get(game_id)
+    if state is not None:
+        game = state
+        rounds = list(zip(state.history[::2], state.history[1::2]))
+    else:
+        game = Game.query.get(game_id) or GameArchive.query.get(game_id)
+        if game is None:
+            return jsonify({'error': 'Game not found'}), 404
+        rounds = db.session.query(Round.sender_card, Round.receiver_card) \
+            .filter_by(game_id=game_id).order_by(Round.round_number).all()
+    return jsonify({
+        'game_id': game_id,
+        'sender_id': game.sender_id,
+        'receiver_id': game.receiver_id,
+        'status': game.status,
+        'score': sum(sender_card == receiver_card for sender_card, receiver_card in rounds),
+        'rounds': [{
+            'round': number,
+            'sender_card': sender_card,
+            'receiver_card': receiver_card,
+            'is_correct': sender_card == receiver_card
+        } for number, (sender_card, receiver_card) in enumerate(rounds, 1)]
+    })
+
+def backfill_stats():
+    """Rebuild the totals and game results from the rounds table.
+
+    Run it while no app process is flushing, or their increments are lost.
+    The database sums each game's rounds; the totals per pair and per user
+    are then summed in one vectorized pass over the games.
+    """
+    create_schema()
+    games = sqlalchemy.union_all(*(
+        sqlalchemy.select(model.id, model.sender_id, model.receiver_id, model.status)
+        for model in (Game, GameArchive)
+    )).subquery()
+    hit_count = sqlalchemy.func.sum(sqlalchemy.case((Round.is_correct, 1), else_=0))
+    per_game = db.session.query(
+        games.c.id, games.c.sender_id, games.c.receiver_id, games.c.status,
+        sqlalchemy.func.count(Round.id), hit_count, sqlalchemy.func.max(Round.finished_at)
+    ).join(Round, Round.game_id == games.c.id) \
+        .filter(games.c.receiver_id.isnot(None)) \
+        .group_by(games.c.id, games.c.sender_id, games.c.receiver_id, games.c.status).all()
+    game_ids, senders, receivers, statuses, rounds, hits, finished_at = \
+        zip(*per_game) if per_game else ((),) * 7
+    finished = [status == 'finished' for status in statuses]
+    pairs, users = recompute_totals(senders, receivers, finished, rounds, hits)
+
+    results = []
+    for row in zip(game_ids, senders, receivers, finished, rounds, hits, finished_at):
+        game_id, sender_id, receiver_id, is_finished = row[:4]
+        if not is_finished:
+            continue
+        for user_id, partner_id, role in ((sender_id, receiver_id, 'sender'),
+                                          (receiver_id, sender_id, 'receiver')):
+            results.append({'user_id': user_id, 'game_id': game_id,
+                            'partner_id': partner_id, 'role': role,
+                            'rounds': row[4], 'hits': row[5], 'finished_at': row[6]})
+    try:
+        for model in (UserStats, PairStats, GameResult):
+            db.session.query(model).delete()
+        db.session.bulk_insert_mappings(PairStats, [
+            {'user_a': a, 'user_b': b, 'games': g, 'rounds': r, 'hits': h, 'z_score': z_score(h, r)}
+            for (a, b), (g, r, h) in pairs.items()
+        ])
+        db.session.bulk_insert_mappings(UserStats, [
+            {'user_id': user_id, 'games': g, 'rounds': r, 'hits': h, 'z_score': z_score(h, r)}
+            for user_id, (g, r, h) in users.items()
+        ])
+        db.session.bulk_insert_mappings(GameResult, results)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(per_game), len(pairs), len(users)
+
+@app.cli.command('backfill-stats')
+def backfill_stats_command():
+    """Rebuild statistics and game history from the rounds table."""
+    games, pairs, users = backfill_stats()
+    print(f"Rebuilt totals for {users} users and {pairs} pairs from {games} games")
+
 @app.route('/auth/google', methods=['POST', 'OPTIONS'])
+@metrics.timed('http.auth_google')
 def google_auth():
     if request.method == 'OPTIONS':
         return '', 204
@@ -119,16 +651,11 @@ def google_auth():
         if not data or 'credential' not in data:
             return jsonify({'error': 'No credential provided'}), 400
 
-        client_id = os.getenv('GOOGLE_CLIENT_ID')
-        if not client_id:
+        if not verifier.client_id:
             return jsonify({'error': 'Server configuration error'}), 500
 
         try:
-            id_info = id_token.verify_oauth2_token(
-                data['credential'],
-                requests.Request(),
-                client_id
-            )
+            id_info = verifier.verify(data['credential'])
         except Exception as e:
             return jsonify({'error': f'Invalid token: {str(e)}'}), 400
 
@@ -146,13 +673,15 @@ def google_auth():
             if not user:
                 user = User(id=user_id, email=email, name=name)
                 db.session.add(user)
-                db.session.commit()
+                with metrics.timer('db.commit'):
+                    db.session.commit()
 
             # Return simple dict to avoid recursion
             return jsonify({
                 'user_id': user.id,
                 'email': user.email,
-                'name': user.name
+                'name': user.name,
+                'session_token': session_tokens.issue(user.id, user.email)
             }), 200
 
         except Exception as e:
@@ -163,76 +692,260 @@ def google_auth():
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
 @socketio.on('connect')
-def handle_connect():
-    logger.info(f"Client connected: {request.sid}")
+@metrics.timed('socketio.connect')
+def handle_connect(auth=None):
+    user = session_tokens.verify((auth or {}).get('token'))
+    if user is None:
+        event_logger.info("Rejected unauthenticated client: %s", request.sid)
+        raise ConnectionRefusedError('Authentication required')
+    wait, _ = user_limits.take(user['user_id'], 'connect')
+    if wait:
+        metrics.count('throttled.connect')
+        raise ConnectionRefusedError('Too many connections, try again later')
+    presence.add(request.sid, user['user_id'], user['email'])
+    event_logger.info("Client connected: %s as %s", request.sid, user['user_id'])
+    user_online(request.sid, {'email': user['email']})
+    if client_manager is not None:
+        client_manager.broadcast_game_event('user_online', request.sid, {'email': user['email']})
 
 @socketio.on('disconnect')
+@metrics.timed('socketio.disconnect')
 def handle_disconnect():
-    logger.info(f"Client disconnected: {request.sid}")
+    presence.remove(request.sid)
+    connection_limits.forget(request.sid)
+    outbox.forget(socketio.server.manager.eio_sid_from_sid(request.sid, '/'))
+    event_logger.info("Client disconnected: %s", request.sid)
+
+def current_user():
+    return presence.user(request.sid)
+
+def rate_limited(event):
+    """Drop ``event`` from a connection or user sending it faster than RATE_LIMITS allows."""
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args):
+            wait, first = connection_limits.take(request.sid, event)
+            if not wait:
+                wait, first = user_limits.take(current_user()['user_id'], event)
+            if not wait:
+                return f(*args)
+            metrics.count(f'throttled.{event}')
+            # Said once per burst of refusals, so throttling never adds to the flood
+            if first:
+                emit('error', {
+                    'message': f'Too many {event} requests, slow down',
+                    'event': event,
+                    'retry_after': round(wait, 2)
+                })
+        return wrapper
+    return decorator
+
+def deliver_invitation(email, invitation):
+    """Send an invitation to every tab the user has open in this process."""
+    sids = tuple(presence.sids_for_email(email))
+    for sid in sids:
+        socketio.emit('game_invitation', invitation, to=sid)
+    return bool(sids)
+
+def user_online(sid, data):
+    pending = inbox.drain(data['email'])
+    if pending:
+        socketio.emit('game_invitations', pending, to=sid)
+
+def remote_invitation(sid, data):
+    if deliver_invitation(data['email'], data['invitation']):
+        client_manager.broadcast_game_event('invitation_delivered', sid, {
+            'email': data['email'],
+            'game_id': data['invitation']['game_id']
+        })
+
+def invitation_delivered(sid, data):
+    inbox.discard(data['email'], data['game_id'])
+
+def new_game_id():
+    # The first SHARD_KEY_LENGTH hex chars name the process that owns the game,
+    # and 64 random bits follow so ids stay unique within one process
+    shard = client_manager.shard if client_manager else os.urandom(4).hex()
+    return f"game_{shard}{os.urandom(8).hex()}"
+
+def game_shard(game_id):
+    return game_id[5:5 + SHARD_KEY_LENGTH]
+
+def dispatch_game_event(event, data):
+    """Run a game event here, or forward it to the process that owns the game."""
+    sid = request.sid
+    game_id = data['game_id']
+    # Never trust the client's user_id; forwarded events carry the verified one
+    data = dict(data, user_id=current_user()['user_id'])
+    if client_manager is not None and engine.get(game_id) is None:
+        shard = game_shard(game_id)
+        if shard != client_manager.shard and client_manager.is_alive(shard):
+            # The owner sends anything meant for the socket itself back to us
+            client_manager.forward_game_event(shard, event, sid, dict(data, origin=client_manager.shard))
+            return
+    game_events[event](sid, data)
+
+def handle_forwarded_game_event(event, sid, data):
+    with app.app_context(), metrics.timer(f'forwarded.{event}'):
+        game_events[event](sid, data)
+
+if client_manager is not None:
+    client_manager.game_handler = handle_forwarded_game_event
+    # Start listening for the other processes now rather than on the first connection
+    socketio.server.manager_initialized = True
+    client_manager.initialize()
 
 @socketio.on('create_game')
+@rate_limited('create_game')
+@metrics.timed('socketio.create_game')
 def create_game(data):
-    logger.info(f"Creating game with data: {data}")
     try:
-        sender_id = data['sender_id']
-        game_id = f"game_{os.urandom(8).hex()}"
+        sender_id = current_user()['user_id']
+        game_id = new_game_id()
         
-        game = Game(id=game_id, sender_id=sender_id)
-        db.session.add(game)
-        db.session.commit()
+        engine.create(game_id, sender_id)
         
-        logger.info(f"Game created successfully: {game_id}")
-        emit('game_created', {'game_id': game_id}, room=sender_id)
+        event_logger.info("Game created: %s by %s", game_id, sender_id)
+        emit('game_created', {'game_id': game_id})
+    except GameError as e:
+        emit('error', {'message': str(e)})
     except Exception as e:
-        logger.error(f"Error creating game: {str(e)}")
+        logger.error("Error creating game: %s", e)
         emit('error', {'message': 'Failed to create game'})
 
 @socketio.on('invite_player')
+@rate_limited('invite_player')
+@metrics.timed('socketio.invite_player')
 def invite_player(data):
-    logger.info(f"Inviting player with data: {data}")
     try:
-        receiver_email = data['email']
-        game_id = data['game_id']
+        receiver_email = normalize_email(data['email'])
+        invitation = {
+            'game_id': data['game_id'],
+            'sender_email': current_user()['email']
+        }
         
-        emit('game_invitation', {
-            'game_id': game_id, 
-            'sender_email': data['sender_email']
-        }, room=receiver_email)
-        logger.info(f"Invitation sent to {receiver_email}")
+        if deliver_invitation(receiver_email, invitation):
+            event_logger.info("Invitation for %s sent to %s", invitation['game_id'], receiver_email)
+            return
+        inbox.hold(receiver_email, invitation)
+        if client_manager is not None:
+            # The user may be connected to another process
+            client_manager.broadcast_game_event('invitation', request.sid, {
+                'email': receiver_email,
+                'invitation': invitation
+            })
+        event_logger.info("Invitation for %s held for %s", invitation['game_id'], receiver_email)
     except Exception as e:
-        logger.error(f"Error sending invitation: {str(e)}")
+        logger.error("Error sending invitation: %s", e)
         emit('error', {'message': 'Failed to send invitation'})
 
 @socketio.on('join_game')
+@rate_limited('join_game')
+@metrics.timed('socketio.join_game')
 def on_join(data):
-    logger.info(f"Player joining game with data: {data}")
+    try:
+        dispatch_game_event('join_game', data)
+    except Exception as e:
+        logger.error("Error joining game: %s", e)
+        emit('error', {'message': 'Failed to join game'})
+
+def join_game(sid, data):
     try:
         game_id = data['game_id']
         user_id = data['user_id']
         
-        join_room(game_id)
-        
-        game = Game.query.get(game_id)
-        game.receiver_id = user_id
-        game.status = 'active'
-        db.session.commit()
+        state = load_game(game_id)
+        if state is None:
+            socketio.emit('error', {'message': 'Game not found'}, to=sid)
+            return
+        engine.join(game_id, user_id)
+        # Only a player of the game may hear its events
+        if data.get('origin') is None:
+            enter_game(sid, {'game_id': game_id})
+        else:
+            client_manager.forward_game_event(data['origin'], 'enter_game', sid, {'game_id': game_id})
         
-        logger.info(f"Player {user_id} joined game {game_id}")
-        emit('game_joined', {'game_id': game_id}, room=game_id)
+        event_logger.info("Player %s joined game %s", user_id, game_id)
+        socketio.emit('game_joined', {
+            'game_id': game_id,
+            'first_player_id': state.sender_id,
+            'round': state.round,
+            'score': state.score
+        }, room=game_id)
+    except GameError as e:
+        socketio.emit('error', {'message': str(e)}, to=sid)
     except Exception as e:
-        logger.error(f"Error joining game: {str(e)}")
-        emit('error', {'message': 'Failed to join game'})
+        logger.error("Error joining game: %s", e)
+        socketio.emit('error', {'message': 'Failed to join game'}, to=sid)
+
+def enter_game(sid, data):
+    """Put ``sid`` in the game's room; runs in the process the socket is connected to."""
+    socketio.server.enter_room(sid, data['game_id'], namespace='/')
+    presence.set_game(sid, data['game_id'])
+
+@socketio.on('card_selected')
+@rate_limited('card_selected')
+@metrics.timed('socketio.card_selected')
+def on_card_selected(data):
+    try:
+        if isinstance(data, int):
+            # Compact form: just the card index, for the game this socket joined
+            game_id = current_user()['game_id']
+            if game_id is None:
+                emit('error', {'message': 'Join a game first'})
+                return
+            data = {'game_id': game_id, 'card_index': data}
+        dispatch_game_event('card_selected', data)
+    except Exception as e:
+        logger.error("Error selecting card: %s", e)
+        emit('error', {'message': 'Failed to select card'})
+
+def card_selected(sid, data):
+    try:
+        game_id = data['game_id']
+        user_id = data['user_id']
+        result = engine.pick(game_id, user_id, int(data['card_index']))
+    except GameError as e:
+        socketio.emit('error', {'message': str(e)}, to=sid)
+        return
+    except Exception as e:
+        logger.error("Error selecting card: %s", e)
+        socketio.emit('error', {'message': 'Failed to select card'}, to=sid)
+        return
+
+    socketio.emit('card_selected_update', {'game_id': game_id, 'user_id': user_id}, room=game_id)
+    if result is not None:
+        round_number, sender_card, receiver_card, is_correct = result
+        state = engine.get(game_id)
+        socketio.emit('card_check_result', {
+            'game_id': game_id,
+            'round': round_number,
+            'sender_card': sender_card,
+            'receiver_card': receiver_card,
+            'is_correct': is_correct,
+            'score': state.score,
+            'finished': state.status == 'finished'
+        }, room=game_id)
+
+game_events = {
+    'join_game': join_game,
+    'enter_game': enter_game,
+    'card_selected': card_selected,
+    'user_online': user_online,
+    'invitation': remote_invitation,
+    'invitation_delivered': invitation_delivered,
+}
 
 @socketio.on_error()
 def error_handler(e):
-    logger.error(f"SocketIO error: {str(e)}")
+    logger.error("SocketIO error: %s", e)
 
 if __name__ == '__main__':
     with app.app_context():
         logger.info("Creating database tables...")
-        db.create_all()
+        create_schema()
         logger.info("Database tables created successfully")
     
     port = int(os.getenv('PORT', 5000))
-    logger.info(f"Starting server on port {port}")
+    logger.info("Starting server on port %d", port)
     socketio.run(app, host='0.0.0.0', port=port, debug=False)
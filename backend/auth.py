@@ -0,0 +1,125 @@
+"""Google sign-in verification and server-issued session tokens.
+
+Verifying a Google ID token needs Google's signing certificates. They are
+fetched over a pooled HTTP session and cached for as long as the endpoint's
+``Cache-Control: max-age`` allows, and credentials that already passed
+verification are remembered until they expire. After login the client gets a
+session token signed with the app's secret key, which the Socket.IO
+``connect`` handler checks locally.
+"""
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from google.auth import exceptions
+from google.auth.transport import requests as google_requests
+from google.oauth2 import id_token
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+GOOGLE_CERTS_URL = 'https://www.googleapis.com/oauth2/v1/certs'
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+
+_MAX_AGE = re.compile(r'max-age=(\d+)')
+
+
+def pooled_session(pool_size=10):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                            pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class CachingRequest(google_requests.Request):
+    """google-auth transport that caches GET responses for ``cacheable`` URLs.
+
+    Responses are kept for the ``max-age`` of their Cache-Control header and
+    are not cached at all without one.
+    """
+
+    def __init__(self, session=None, cacheable=()):
+        super().__init__(session=session or pooled_session())
+        self.cacheable = frozenset(cacheable)
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, url, method='GET', body=None, headers=None, **kwargs):
+        if method != 'GET' or url not in self.cacheable:
+            return super().__call__(url, method=method, body=body,
+                                    headers=headers, **kwargs)
+        cached = self._cache.get(url)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        # Concurrent misses wait for a single fetch instead of each making one
+        with self._lock:
+            cached = self._cache.get(url)
+            if cached is not None and cached[0] > time.monotonic():
+                return cached[1]
+            response = super().__call__(url, method=method, body=body,
+                                        headers=headers, **kwargs)
+            if response.status == 200:
+                match = _MAX_AGE.search(
+                    response.headers.get('cache-control', ''))
+                if match:
+                    self._cache[url] = (
+                        time.monotonic() + int(match.group(1)), response)
+            return response
+
+
+class GoogleTokenVerifier:
+    """Verifies Google ID tokens, remembering recent results until ``exp``."""
+
+    def __init__(self, client_id, certs_url=GOOGLE_CERTS_URL, max_entries=10000,
+                 request=None):
+        self.client_id = client_id
+        self.certs_url = certs_url
+        self.max_entries = max_entries
+        self.request = request or CachingRequest(cacheable=[certs_url])
+        self._verified = OrderedDict()
+
+    def verify(self, credential):
+        if isinstance(credential, str):
+            credential = credential.encode('utf-8')
+        key = hashlib.sha256(credential).digest()
+        id_info = self._verified.get(key)
+        if id_info is not None:
+            if id_info['exp'] > time.time():
+                self._verified.move_to_end(key)
+                return id_info
+            del self._verified[key]
+
+        id_info = id_token.verify_token(credential, self.request,
+                                        audience=self.client_id,
+                                        certs_url=self.certs_url)
+        if id_info.get('iss') not in GOOGLE_ISSUERS:
+            raise exceptions.GoogleAuthError(
+                f"Wrong issuer: {id_info.get('iss')}")
+        self._verified[key] = id_info
+        while len(self._verified) > self.max_entries:
+            self._verified.popitem(last=False)
+        return id_info
+
+
+class SessionTokens:
+    """Signed ``{'user_id', 'email'}`` tokens that need no lookup to check."""
+
+    def __init__(self, secret_key, max_age=7 * 24 * 3600):
+        self.max_age = max_age
+        self._serializer = URLSafeTimedSerializer(secret_key,
+                                                  salt='socketio-session')
+
+    def issue(self, user_id, email):
+        return self._serializer.dumps({'user_id': user_id, 'email': email})
+
+    def verify(self, token):
+        """Return the token's user dict, or None if it is invalid or expired."""
+        if not token:
+            return None
+        try:
+            return self._serializer.loads(token, max_age=self.max_age)
+        except BadSignature:
+            return None
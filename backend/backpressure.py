@@ -0,0 +1,201 @@
+"""Rate limits for incoming events and bounded outgoing queues per connection.
+
+RateLimiter keeps a token bucket per key (a connection's sid or a user id)
+for each configured event type, packed into one small array per key, so a
+client sending faster than its limit is turned away before its event does
+any work. Outbox sits in front of every event sent to a client: while the
+client keeps up packets go straight out, and when its Engine.IO queue backs
+up (a slow polling client) later updates are held in a small per-connection
+buffer where a newer update for the same game replaces the stale one and
+the oldest updates are dropped once it is full. One-time events such as
+game_created are never dropped; a client that falls that far behind is
+disconnected instead.
+"""
+import time
+from array import array
+from collections import OrderedDict
+from itertools import count
+
+DEFAULT_RATE_LIMITS = ('connect=1/10,create_game=0.5/5,invite_player=1/10,'
+                       'join_game=2/10,card_selected=5/20,*=10/30')
+# Updates where a client that has fallen behind only needs the latest per game
+COALESCED_EVENTS = ('card_selected_update', 'card_check_result', 'game_joined')
+
+
+def parse_limits(spec):
+    """Parse ``event=rate/burst,...`` into {event: (rate, burst)}.
+
+    ``rate`` is events per second (above zero) and ``burst`` the most that
+    can arrive at once; ``*`` covers every event not listed. ``off`` disables
+    limits.
+    """
+    limits = {}
+    if spec.strip().lower() == 'off':
+        return limits
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        event, _, value = item.partition('=')
+        rate, _, burst = value.partition('/')
+        rate, burst = float(rate), float(burst or rate)
+        if rate <= 0 or burst < 1:
+            raise ValueError(f'Invalid rate limit: {item}')
+        limits[event.strip()] = (rate, burst)
+    return limits
+
+
+class RateLimiter:
+    """Token buckets per key for each event type in ``limits``."""
+
+    def __init__(self, limits, clock=time.monotonic):
+        self.clock = clock
+        self._events = {event: i for i, event in enumerate(limits)}
+        self._limits = list(limits.values())
+        self._default = self._events.get('*')
+        self._buckets = {}
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key, event):
+        """Spend a token of ``key``'s ``event`` bucket.
+
+        Returns ``(wait, first)``: ``wait`` is 0 when the event may go ahead,
+        otherwise the seconds until a token is available; ``first`` is true
+        for the first refusal since the last event that went ahead, so the
+        client is told once rather than on every dropped event.
+        """
+        i = self._events.get(event, self._default)
+        if i is None:
+            return 0.0, False
+        rate, burst = self._limits[i]
+        now = self.clock()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            # (tokens, updated, refused) per event type
+            bucket = self._buckets[key] = array(
+                'd', [value for rate_burst in self._limits
+                      for value in (rate_burst[1], now, 0.0)])
+        slot = 3 * i
+        tokens = min(burst, bucket[slot] + (now - bucket[slot + 1]) * rate)
+        bucket[slot + 1] = now
+        if tokens >= 1:
+            bucket[slot] = tokens - 1
+            bucket[slot + 2] = 0.0
+            return 0.0, False
+        bucket[slot] = tokens
+        first = not bucket[slot + 2]
+        bucket[slot + 2] = 1.0
+        return (1 - tokens) / rate, first
+
+    def forget(self, key):
+        self._buckets.pop(key, None)
+
+    def prune(self):
+        """Drop keys whose buckets have all refilled; they hold no state."""
+        now = self.clock()
+        for key in list(self._buckets):
+            bucket = self._buckets[key]
+            if all(bucket[3 * i] + (now - bucket[3 * i + 1]) * rate >= burst
+                   for i, (rate, burst) in enumerate(self._limits)):
+                del self._buckets[key]
+
+    def run(self, sleep, interval=60):
+        while True:
+            sleep(interval)
+            self.prune()
+
+
+class Outbox:
+    """Holds packets for clients that are not picking them up.
+
+    ``send(eio_sid, pkt)`` passes the packet to ``send_packet`` unless
+    ``backlog(eio_sid)``, the number of packets already waiting for that
+    client (None once it has gone), has reached ``max_backlog``. Only then
+    is the packet looked at: ``describe(pkt)`` returns the ``(event, data)``
+    it carries, or None for a packet that must go out as it is. Held packets
+    are keyed so that an update in COALESCED_EVENTS replaces an older one
+    for the same game. Past ``max_held`` packets for a client the oldest
+    such update is dropped; other events are never dropped, so a client
+    holding nothing else is given up on: its packets are discarded and
+    ``on_overflow(eio_sid)`` is called to disconnect it. ``flush`` sends
+    what the clients have room for.
+    """
+
+    def __init__(self, send_packet, backlog, describe, max_backlog=32,
+                 max_held=16, on_overflow=None):
+        self._send_packet = send_packet
+        self._backlog = backlog
+        self._describe = describe
+        self.on_overflow = on_overflow
+        self.max_backlog = max_backlog
+        self.max_held = max_held
+        self._held = {}
+        self._sequence = count()
+        self.deferred = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.overflowed = 0
+
+    def __len__(self):
+        return sum(len(held) for held in self._held.values())
+
+    def send(self, eio_sid, pkt):
+        held = self._held.get(eio_sid)
+        if held is None and \
+                (self._backlog(eio_sid) or 0) < self.max_backlog:
+            self._send_packet(eio_sid, pkt)
+            return
+        message = self._describe(pkt)
+        if message is None:
+            self._send_packet(eio_sid, pkt)
+            return
+        if held is None:
+            held = self._held[eio_sid] = OrderedDict()
+        key = self._coalesce_key(*message)
+        self.deferred += 1
+        if key in held:
+            del held[key]
+            self.coalesced += 1
+        held[key] = pkt
+        if len(held) > self.max_held:
+            self._evict(eio_sid, held)
+
+    def _evict(self, eio_sid, held):
+        for key in held:
+            # Only updates have a (event, game_id) key; see _coalesce_key
+            if isinstance(key, tuple):
+                del held[key]
+                self.dropped += 1
+                return
+        del self._held[eio_sid]
+        self.overflowed += 1
+        if self.on_overflow is not None:
+            self.on_overflow(eio_sid)
+
+    def _coalesce_key(self, event, data):
+        if event in COALESCED_EVENTS and isinstance(data, dict):
+            return event, data.get('game_id')
+        return next(self._sequence)
+
+    def flush(self):
+        for eio_sid in list(self._held):
+            held = self._held[eio_sid]
+            backlog = self._backlog(eio_sid)
+            if backlog is None:
+                del self._held[eio_sid]
+                continue
+            room = self.max_backlog - backlog
+            while held and room > 0:
+                self._send_packet(eio_sid, held.popitem(last=False)[1])
+                room -= 1
+            if not held:
+                del self._held[eio_sid]
+
+    def forget(self, eio_sid):
+        self._held.pop(eio_sid, None)
+
+    def run(self, sleep, interval=0.1):
+        while True:
+            sleep(interval)
+            self.flush()
@@ -0,0 +1,131 @@
+"""Helpers shared by the benchmarks: app processes, a Google cert stub, stats."""
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import rsa
+from google.auth import crypt, jwt
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLIENT_ID = 'bench-client.apps.googleusercontent.com'
+SECRET_KEY = 'bench-secret'
+KEY_ID = 'bench'
+
+
+def wait_for(url, timeout=30):
+    # urllib rather than requests: under the load test's gevent patching,
+    # polling through a fresh urllib3 pool would now and then never wake up
+    deadline = time.time() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(url, timeout=1):
+                return
+        except OSError:
+            if time.time() > deadline:
+                raise RuntimeError(f'{url} did not come up')
+            time.sleep(0.2)
+
+
+def start_app(port, workdir, name='bench', **env):
+    """Start app.py on ``port`` with its own SQLite database."""
+    env = dict(os.environ,
+               PORT=str(port),
+               SECRET_KEY=SECRET_KEY,
+               DATABASE_URL=f'sqlite:///{workdir}/{name}.db',
+               LOG_LEVEL='WARNING',
+               **env)
+    proc = subprocess.Popen([sys.executable, 'app.py'], cwd=BACKEND_DIR,
+                            env=env, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL)
+    wait_for(f'http://127.0.0.1:{port}/health')
+    return proc
+
+
+def stop(procs):
+    for proc in procs:
+        proc.terminate()
+    for proc in procs:
+        proc.wait()
+
+
+def rss_kb(pid):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def percentiles(samples):
+    """p50/p95/p99 in milliseconds of a list of durations in seconds."""
+    samples = sorted(samples)
+    if not samples:
+        return {'count': 0}
+
+    def pct(p):
+        return round(samples[min(len(samples) - 1,
+                                 int(len(samples) * p))] * 1000, 3)
+
+    return {'count': len(samples), 'p50_ms': pct(0.50),
+            'p95_ms': pct(0.95), 'p99_ms': pct(0.99)}
+
+
+class CertStub(ThreadingHTTPServer):
+    """Serves an RSA public key the way Google's v1 certs endpoint does.
+
+    ``credential(i)`` returns an ID token for user ``i`` signed with the
+    matching private key, so the app verifies it exactly as it would a real
+    Google credential when GOOGLE_CERTS_URL points at ``certs_url``.
+    """
+    daemon_threads = True
+
+    def __init__(self, max_age=3600):
+        super().__init__(('127.0.0.1', 0), _CertHandler)
+        public_key, private_key = rsa.newkeys(2048)
+        self.body = json.dumps(
+            {KEY_ID: public_key.save_pkcs1().decode('ascii')}).encode('utf-8')
+        self.signer = crypt.RSASigner.from_string(private_key.save_pkcs1(),
+                                                  key_id=KEY_ID)
+        self.max_age = max_age
+        self.hits = 0
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def certs_url(self):
+        return f'http://127.0.0.1:{self.server_port}/certs'
+
+    def app_env(self):
+        return {'GOOGLE_CLIENT_ID': CLIENT_ID,
+                'GOOGLE_CERTS_URL': self.certs_url}
+
+    def credential(self, i):
+        now = int(time.time())
+        return jwt.encode(self.signer, {
+            'iss': 'https://accounts.google.com',
+            'aud': CLIENT_ID,
+            'sub': f'bench-user-{i}',
+            'email': f'user{i}@bench.local',
+            'name': f'User {i}',
+            'iat': now,
+            'exp': now + 3600,
+        }).decode('utf-8')
+
+
+class _CertHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.hits += 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Cache-Control',
+                         f'public, max-age={self.server.max_age}')
+        self.send_header('Content-Length', str(len(self.server.body)))
+        self.end_headers()
+        self.wfile.write(self.server.body)
+
+    def log_message(self, *args):
+        pass
@@ -0,0 +1,171 @@
+"""Game latency while other clients flood the server with events.
+
+Plays a round of well-behaved games on their own, then the same number of
+games again while flooding clients spam create_game, invite_player (at the
+players' emails) and card_selected as fast as --flood-rate allows. Reports
+card_selected latency for both phases and the server's throttling and
+outbox counters. Run from the backend directory, once with the default
+limits and once with them switched off:
+
+    python bench/flood.py --games 50 --flooders 5
+    python bench/flood.py --games 50 --flooders 5 --rate-limits off
+
+With rate limiting a flood costs the server one bucket check per event, so
+the latency of the second phase should stay close to the first.
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import argparse  # noqa: E402
+import itertools  # noqa: E402
+import tempfile  # noqa: E402
+import time  # noqa: E402
+from collections import defaultdict  # noqa: E402
+
+import gevent  # noqa: E402
+import requests  # noqa: E402
+import socketio  # noqa: E402
+
+from common import CertStub, percentiles, start_app, stop  # noqa: E402
+from loadtest import SERIALIZERS, Player, play_game  # noqa: E402
+
+
+class Flooder:
+    def __init__(self, url, transport, protocol, emails, rate):
+        self.url = url
+        self.transport = transport
+        self.emails = itertools.cycle(emails)
+        self.interval = 1 / rate
+        self.game_id = 'game_flood'
+        self.sent = self.errors = 0
+        self.sio = socketio.Client(reconnection=False,
+                                   serializer=SERIALIZERS[protocol])
+        self.sio.on('game_created', self._game_created)
+        self.sio.on('error', self._error)
+
+    def _game_created(self, data):
+        # Invitations to a real game reach the players
+        self.game_id = data['game_id']
+
+    def _error(self, data):
+        self.errors += 1
+
+    def connect(self, token):
+        self.sio.connect(self.url, transports=[self.transport],
+                         auth={'token': token})
+
+    def run(self):
+        for event in itertools.cycle(('create_game', 'invite_player',
+                                      'card_selected')):
+            if event == 'invite_player':
+                data = {'email': next(self.emails), 'game_id': self.game_id}
+            elif event == 'card_selected':
+                data = {'game_id': self.game_id, 'card_index': 0}
+            else:
+                data = {}
+            self.sio.emit(event, data)
+            self.sent += 1
+            gevent.sleep(self.interval)
+
+
+def play_games(players, games):
+    latencies = defaultdict(list)
+    failures = []
+
+    def attempt(sender, receiver):
+        try:
+            play_game(sender, receiver, latencies)
+        except Exception as e:
+            failures.append(repr(e))
+
+    start = time.perf_counter()
+    gevent.joinall([gevent.spawn(attempt, players[2 * i], players[2 * i + 1])
+                    for i in range(games)])
+    return {'seconds': round(time.perf_counter() - start, 3),
+            'failures': len(failures),
+            'failure_samples': failures[:3],
+            'card_selected': percentiles(latencies['card_selected'])}
+
+
+def run(args):
+    stub = CertStub()
+    url = f'http://127.0.0.1:{args.port}'
+    env = dict(stub.app_env(), SOCKETIO_SERIALIZER=SERIALIZERS[args.protocol])
+    if args.rate_limits is not None:
+        env['RATE_LIMITS'] = args.rate_limits
+    players = [Player(i, url, args.transport, args.protocol, defaultdict(list))
+               for i in range(2 * args.games)]
+    flooders = [Flooder(url, args.transport, args.protocol,
+                        [f'user{i}@bench.local' for i in range(len(players))],
+                        args.flood_rate)
+                for _ in range(args.flooders)]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        server = start_app(args.port, workdir, **env)
+        try:
+            http = requests.Session()
+            for player in players:
+                player.login(http, stub.credential(player.index))
+            gevent.joinall([gevent.spawn(p.connect) for p in players])
+            for i, flooder in enumerate(flooders):
+                token = http.post(f'{url}/auth/google', json={
+                    'credential': stub.credential(len(players) + i)
+                }).json()['session_token']
+                flooder.connect(token)
+
+            quiet = play_games(players, args.games)
+            floods = [gevent.spawn(f.run) for f in flooders]
+            flooded = play_games(players, args.games)
+            gevent.killall(floods)
+            metrics = requests.get(f'{url}/metrics', timeout=60).json()
+        finally:
+            for client in [p.sio for p in players] + [f.sio for f in flooders]:
+                if client.connected:
+                    client.disconnect()
+            stop([server])
+            stub.shutdown()
+
+    return {
+        'quiet': quiet,
+        'flooded': flooded,
+        'flood_events_sent': sum(f.sent for f in flooders),
+        'flood_errors_received': sum(f.errors for f in flooders),
+        'throttled': {name: value for name, value in
+                      sorted(metrics['counters'].items())
+                      if name.startswith('throttled.')},
+        'outbox': {name: value for name, value in metrics['gauges'].items()
+                   if name.startswith('outbox_')},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--games', type=int, default=50)
+    parser.add_argument('--flooders', type=int, default=5)
+    parser.add_argument('--flood-rate', type=float, default=200,
+                        help='events per second sent by each flooder')
+    parser.add_argument('--rate-limits',
+                        help='RATE_LIMITS for the server, e.g. off')
+    parser.add_argument('--transport', default='websocket',
+                        choices=['polling', 'websocket'])
+    parser.add_argument('--protocol', default='msgpack',
+                        choices=sorted(SERIALIZERS))
+    parser.add_argument('--port', type=int, default=5600)
+    args = parser.parse_args()
+
+    result = run(args)
+    print(f"{'phase':<10}{'games':>8}{'failures':>10}{'p50 ms':>10}"
+          f"{'p95 ms':>10}{'p99 ms':>10}")
+    for phase in ('quiet', 'flooded'):
+        stats = result[phase]['card_selected']
+        print(f"{phase:<10}{args.games:>8}{result[phase]['failures']:>10}"
+              f"{stats.get('p50_ms', '-'):>10}{stats.get('p95_ms', '-'):>10}"
+              f"{stats.get('p99_ms', '-'):>10}")
+    print(f"flood events sent: {result['flood_events_sent']}, "
+          f"errors received: {result['flood_errors_received']}")
+    print(f"throttled: {result['throttled']}")
+    print(f"outbox: {result['outbox']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""Statistics and history query latency as the rounds table grows.
+
+For each size, seeds a fresh SQLite database with finished games between
+random pairs of users, rebuilds the totals with ``flask backfill-stats``,
+then times the stats, leaderboard, history and game endpoints of a running
+app. Run from the backend directory:
+
+    python bench/history.py --rounds 10000 100000 1000000
+
+Flat latencies across sizes mean every endpoint is an index lookup or a
+bounded index range, whatever the size of the history.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import requests
+
+from common import BACKEND_DIR, SECRET_KEY, percentiles, start_app, stop
+
+ROUNDS_PER_GAME = 10
+CARD_COUNT = 8
+
+
+def seed(path, rounds, users, rng):
+    games = rounds // ROUNDS_PER_GAME
+    start = datetime(2024, 1, 1)
+    game_rows, round_rows = [], []
+    for i in range(games):
+        sender, receiver = rng.sample(range(users), 2)
+        game_id = f'game_bench{i:010d}'
+        game_rows.append((game_id, f'user{sender}', f'user{receiver}',
+                          'finished'))
+        finished_at = start + timedelta(seconds=30 * i)
+        for number in range(1, ROUNDS_PER_GAME + 1):
+            sender_card = rng.randrange(CARD_COUNT)
+            receiver_card = rng.randrange(CARD_COUNT)
+            round_rows.append((game_id, number, sender_card, receiver_card,
+                               sender_card == receiver_card,
+                               finished_at.isoformat(' ')))
+    with sqlite3.connect(path) as conn:
+        conn.executemany('INSERT INTO game (id, sender_id, receiver_id, status)'
+                         ' VALUES (?, ?, ?, ?)', game_rows)
+        conn.executemany('INSERT INTO rounds (game_id, round_number, '
+                         'sender_card, receiver_card, is_correct, finished_at)'
+                         ' VALUES (?, ?, ?, ?, ?, ?)', round_rows)
+    return [row[0] for row in game_rows]
+
+
+def time_requests(session, urls):
+    samples = []
+    for url in urls:
+        start = time.perf_counter()
+        response = session.get(url)
+        samples.append(time.perf_counter() - start)
+        response.raise_for_status()
+    return percentiles(samples)
+
+
+def history_pages(session, url, pages):
+    """Follow ``pages`` history cursors, timing each page."""
+    samples = []
+    cursor = None
+    for _ in range(pages):
+        params = {'before': cursor} if cursor else {}
+        start = time.perf_counter()
+        page = session.get(url, params=params).json()
+        samples.append(time.perf_counter() - start)
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    return samples
+
+
+def run(rounds, users, requests_per_endpoint, port, rng):
+    with tempfile.TemporaryDirectory() as workdir:
+        # Start once so app.py creates the schema, then seed it directly
+        stop([start_app(port, workdir)])
+        game_ids = seed(os.path.join(workdir, 'bench.db'), rounds, users, rng)
+
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-m', 'flask', '--app', 'app',
+                        'backfill-stats'], cwd=BACKEND_DIR, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       env=dict(os.environ, LOG_LEVEL='WARNING',
+                                SECRET_KEY=SECRET_KEY,
+                                DATABASE_URL=f'sqlite:///{workdir}/bench.db'))
+        backfill_time = time.perf_counter() - start
+
+        url = f'http://127.0.0.1:{port}'
+        server = start_app(port, workdir)
+        try:
+            # A new connection per request: keep-alive responses from the
+            # development server wait ~40ms on the client's delayed ACK,
+            # which would hide the query cost
+            session = requests
+            n = requests_per_endpoint
+
+            def some_user():
+                return f'user{rng.randrange(users)}'
+
+            latency = {
+                'user_stats': time_requests(session, [
+                    f'{url}/stats/users/{some_user()}' for _ in range(n)]),
+                'pair_stats': time_requests(session, [
+                    f'{url}/stats/pairs/{some_user()}/{some_user()}'
+                    for _ in range(n)]),
+                'leaderboard': time_requests(session, [
+                    f'{url}/leaderboard?limit=20'] * n),
+                'game_history': time_requests(session, [
+                    f'{url}/users/{some_user()}/games' for _ in range(n)]),
+                'game_history_pages': percentiles(history_pages(
+                    session, f'{url}/users/{some_user()}/games', n)),
+                'game_detail': time_requests(session, [
+                    f'{url}/games/{rng.choice(game_ids)}' for _ in range(n)]),
+            }
+        finally:
+            stop([server])
+    return {'rounds': rounds, 'backfill_seconds': round(backfill_time, 2),
+            'latency': latency}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rounds', type=int, nargs='+',
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per endpoint')
+    parser.add_argument('--port', type=int, default=5500)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    results = [run(rounds, args.users, args.requests, args.port, rng)
+               for rounds in args.rounds]
+
+    print(f"{'endpoint':<20}" + ''.join(f"{r['rounds']:>12} rounds p50/p99"
+                                       for r in results))
+    for endpoint in results[0]['latency']:
+        print(f'{endpoint:<20}' + ''.join(
+            f"{r['latency'][endpoint]['p50_ms']:>16.2f}/"
+            f"{r['latency'][endpoint]['p99_ms']:<6.2f}" for r in results))
+    print(f"{'backfill seconds':<20}" + ''.join(
+        f"{r['backfill_seconds']:>23}" for r in results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,332 @@
+"""Load test of full game sessions against a local app process.
+
+Starts app.py on SQLite with the Google cert stub from common.py, then
+drives simulated players through the whole lifecycle: /auth/google,
+connect, create_game, invite_player, join_game and ten rounds of card
+picks. Reports events/sec, p50/p95/p99 latency per event type, server
+memory per connected client, database queries per game and Socket.IO bytes
+and HTTP requests per event, once for each transport and protocol. Run
+from the backend directory:
+
+    pip install -r bench/requirements.txt
+    python bench/loadtest.py --games 1000 --transports polling websocket \
+        --protocols json msgpack
+
+The json protocol is the original one: JSON packets and card picks sent as
+``{game_id, card_index}`` objects. msgpack uses MessagePack packets and
+sends each pick as a bare card index.
+
+Results are written as JSON to --output so they can be compared between
+releases. Clients run as gevent greenlets, so thousands fit in one process.
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import argparse  # noqa: E402
+import json  # noqa: E402
+import platform  # noqa: E402
+import subprocess  # noqa: E402
+import tempfile  # noqa: E402
+import time  # noqa: E402
+from collections import defaultdict  # noqa: E402
+from queue import Empty, Queue  # noqa: E402
+
+import gevent  # noqa: E402
+import requests  # noqa: E402
+import socketio  # noqa: E402
+from gevent.pool import Pool  # noqa: E402
+from socketio.msgpack_packet import MsgPackPacket  # noqa: E402
+from socketio.packet import Packet  # noqa: E402
+
+from common import (BACKEND_DIR, CertStub, percentiles, rss_kb,  # noqa: E402
+                    start_app, stop)
+
+ROUNDS = 10
+# Flush interval given to the server, so the wait for the last flush is short
+WRITE_BEHIND_INTERVAL = 0.5
+SERIALIZERS = {'json': 'default', 'msgpack': 'msgpack'}
+# Seconds a login or connect may take before it counts as a failure
+REQUEST_TIMEOUT = 30
+# Seconds a whole game may take, so one stalled player cannot hang the run
+GAME_TIMEOUT = 300
+
+
+class WireCounter:
+    """Counts Socket.IO packet bytes and HTTP requests made by the clients."""
+
+    def __init__(self):
+        self.reset()
+        for cls in (Packet, MsgPackPacket):
+            cls.encode = self._counting_encode(cls.encode)
+            cls.decode = self._counting_decode(cls.decode)
+        request = requests.Session.request
+
+        def counting_request(session, method, url, *args, **kwargs):
+            if '/socket.io/' in url:
+                self.http_requests += 1
+            return request(session, method, url, *args, **kwargs)
+
+        requests.Session.request = counting_request
+
+    def reset(self):
+        self.bytes_out = self.bytes_in = self.http_requests = 0
+
+    @staticmethod
+    def _size(encoded):
+        if isinstance(encoded, list):
+            return sum(WireCounter._size(part) for part in encoded)
+        if isinstance(encoded, str):
+            return len(encoded.encode('utf-8'))
+        return len(encoded)
+
+    def _counting_encode(self, encode):
+        def wrapper(packet):
+            encoded = encode(packet)
+            self.bytes_out += self._size(encoded)
+            return encoded
+        return wrapper
+
+    def _counting_decode(self, decode):
+        def wrapper(packet, encoded_packet):
+            self.bytes_in += self._size(encoded_packet)
+            return decode(packet, encoded_packet)
+        return wrapper
+
+
+class Player:
+    def __init__(self, index, url, transport, protocol, latencies):
+        self.index = index
+        self.url = url
+        self.transport = transport
+        self.compact_picks = protocol == 'msgpack'
+        self.latencies = latencies
+        self.events = Queue()
+        self.user = None
+        self.sio = socketio.Client(reconnection=False,
+                                   serializer=SERIALIZERS[protocol])
+        self.sio.on('*', lambda event, data: self.events.put((event, data)))
+
+    def login(self, http, credential):
+        start = time.perf_counter()
+        response = http.post(f'{self.url}/auth/google',
+                             json={'credential': credential},
+                             timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        self.latencies['auth'].append(time.perf_counter() - start)
+        self.user = response.json()
+
+    def connect(self):
+        start = time.perf_counter()
+        self.sio.connect(self.url, transports=[self.transport],
+                         auth={'token': self.user['session_token']},
+                         wait_timeout=REQUEST_TIMEOUT)
+        self.latencies['connect'].append(time.perf_counter() - start)
+
+    def wait(self, name, timeout=60):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                event, data = self.events.get(
+                    timeout=max(0, deadline - time.monotonic()))
+            except Empty:
+                raise TimeoutError(f'player {self.index} timed out waiting '
+                                   f'for {name}')
+            if event == 'error':
+                raise RuntimeError(data['message'])
+            if event == name:
+                return data
+
+    def request(self, event, data, reply):
+        start = time.perf_counter()
+        self.sio.emit(event, data)
+        result = self.wait(reply)
+        self.latencies[event].append(time.perf_counter() - start)
+        return result
+
+
+def play_game(sender, receiver, latencies):
+    game_id = sender.request('create_game', {}, 'game_created')['game_id']
+
+    start = time.perf_counter()
+    sender.sio.emit('invite_player', {'email': receiver.user['email'],
+                                      'game_id': game_id})
+    receiver.wait('game_invitation')
+    latencies['invite_player'].append(time.perf_counter() - start)
+
+    for player in (sender, receiver):
+        player.request('join_game', {'game_id': game_id}, 'game_joined')
+
+    for round_number in range(ROUNDS):
+        start = time.perf_counter()
+        for player in (sender, receiver):
+            card = (player.index + round_number) % 8
+            if player.compact_picks:
+                player.sio.emit('card_selected', card)
+            else:
+                player.sio.emit('card_selected', {'game_id': game_id,
+                                                  'card_index': card})
+        for player in (sender, receiver):
+            player.wait('card_check_result')
+        latencies['card_selected'].append(time.perf_counter() - start)
+
+
+def server_metrics(url):
+    return requests.get(f'{url}/metrics', timeout=10).json()
+
+
+def run(transport, protocol, games, port, concurrency, wire):
+    stub = CertStub()
+    url = f'http://127.0.0.1:{port}'
+    latencies = defaultdict(list)
+    players = [Player(i, url, transport, protocol, latencies)
+               for i in range(2 * games)]
+    failures = []
+
+    def attempt(timeout, f, *args):
+        try:
+            with gevent.Timeout(timeout, TimeoutError(
+                    f'{f.__name__} took over {timeout}s')):
+                f(*args)
+        except Exception as e:
+            failures.append(repr(e))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        server = start_app(port, workdir,
+                           WRITE_BEHIND_INTERVAL=str(WRITE_BEHIND_INTERVAL),
+                           SOCKETIO_SERIALIZER=SERIALIZERS[protocol],
+                           **stub.app_env())
+        try:
+            base_rss = rss_kb(server.pid)
+            pool = Pool(concurrency)
+            http = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=concurrency)
+            http.mount('http://', adapter)
+            credentials = [stub.credential(i) for i in range(len(players))]
+
+            start = time.perf_counter()
+            for player, credential in zip(players, credentials):
+                pool.spawn(attempt, REQUEST_TIMEOUT, player.login, http,
+                           credential)
+            pool.join()
+            for player in players:
+                pool.spawn(attempt, REQUEST_TIMEOUT, player.connect)
+            pool.join()
+            setup_time = time.perf_counter() - start
+            connected = sum(1 for p in players if p.sio.connected)
+            connected_rss = rss_kb(server.pid)
+            queries_before = server_metrics(url)['counters'].get(
+                'db.queries', 0)
+
+            wire.reset()
+            start = time.perf_counter()
+            gevent.joinall([
+                gevent.spawn(attempt, GAME_TIMEOUT, play_game,
+                             players[2 * i], players[2 * i + 1], latencies)
+                for i in range(games)])
+            play_time = time.perf_counter() - start
+            bytes_out, bytes_in = wire.bytes_out, wire.bytes_in
+            http_requests = wire.http_requests
+
+            # Let the write-behind buffer reach the database
+            time.sleep(WRITE_BEHIND_INTERVAL * 3)
+            metrics = server_metrics(url)
+            queries = metrics['counters'].get('db.queries', 0) - \
+                queries_before
+            peak_rss = rss_kb(server.pid)
+        finally:
+            for player in players:
+                if player.sio.connected:
+                    player.sio.disconnect()
+            stop([server])
+            stub.shutdown()
+
+    # create, invite, two joins and two picks per round
+    events = games * (4 + 2 * ROUNDS)
+    return {
+        'transport': transport,
+        'protocol': protocol,
+        'games': games,
+        'clients': len(players),
+        'connected': connected,
+        'failures': len(failures),
+        'failure_samples': failures[:5],
+        'setup_seconds': round(setup_time, 3),
+        'play_seconds': round(play_time, 3),
+        'events_per_sec': round(events / play_time, 1),
+        'bytes_sent_per_event': round(bytes_out / events, 1),
+        'bytes_received_per_event': round(bytes_in / events, 1),
+        'http_requests_per_event': round(http_requests / events, 2),
+        'latency': {event: percentiles(samples)
+                    for event, samples in sorted(latencies.items())},
+        'server_rss_kb': {'base': base_rss, 'connected': connected_rss,
+                          'peak': peak_rss},
+        'memory_per_client_kb': round(
+            (connected_rss - base_rss) / max(1, connected), 2),
+        'db_queries_per_game': round(queries / games, 2),
+        'cert_fetches': stub.hits,
+        'server_metrics': metrics,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_summary(result):
+    print(f"\n{result['transport']}/{result['protocol']}: "
+          f"{result['games']} games, {result['clients']} clients, "
+          f"{result['failures']} failures")
+    print(f"  events/s:           {result['events_per_sec']}")
+    print(f"  bytes/event:        {result['bytes_sent_per_event']} sent, "
+          f"{result['bytes_received_per_event']} received")
+    print(f"  HTTP requests/event: {result['http_requests_per_event']}")
+    print(f"  memory per client:  {result['memory_per_client_kb']} KB")
+    print(f"  db queries per game: {result['db_queries_per_game']}")
+    print(f"  {'event':<16}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'p99 ms':>10}")
+    for event, stats in result['latency'].items():
+        print(f"  {event:<16}{stats['count']:>8}{stats['p50_ms']:>10}"
+              f"{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--games', type=int, default=200)
+    parser.add_argument('--transports', nargs='+',
+                        default=['polling', 'websocket'],
+                        choices=['polling', 'websocket'])
+    parser.add_argument('--protocols', nargs='+', default=['msgpack'],
+                        choices=sorted(SERIALIZERS))
+    parser.add_argument('--concurrency', type=int, default=200,
+                        help='simultaneous logins and connects')
+    parser.add_argument('--port', type=int, default=5400)
+    parser.add_argument('--output', default='loadtest.json')
+    args = parser.parse_args()
+
+    wire = WireCounter()
+    results = []
+    for transport in args.transports:
+        for protocol in args.protocols:
+            result = run(transport, protocol, args.games, args.port,
+                         args.concurrency, wire)
+            print_summary(result)
+            results.append(result)
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'games': args.games,
+            'results': results,
+        }, f, indent=2)
+    print(f'\nResults written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Login latency against a local stand-in for Google's certificate endpoint.
+
+Serves a generated RSA public key the way
+https://www.googleapis.com/oauth2/v1/certs does (with a Cache-Control
+max-age), starts app.py pointed at it through GOOGLE_CERTS_URL, and posts
+signed ID tokens to /auth/google. Run from the backend directory:
+
+    python bench/login.py --logins 2000 --users 200 --concurrency 20
+
+Each user's credential is reused for its repeated logins, so the report
+covers both freshly verified and already verified credentials. The number
+of certificate fetches shows whether the cert cache is working.
+"""
+import argparse
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from common import CertStub, percentiles, start_app, stop
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--logins', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--port', type=int, default=5200)
+    parser.add_argument('--cert-max-age', type=int, default=3600)
+    args = parser.parse_args()
+
+    stub = CertStub(args.cert_max_age)
+    credentials = [stub.credential(i) for i in range(args.users)]
+    url = f'http://127.0.0.1:{args.port}'
+
+    with tempfile.TemporaryDirectory() as workdir:
+        server = start_app(args.port, workdir, **stub.app_env())
+        try:
+            local = threading.local()
+
+            def login(i):
+                if not hasattr(local, 'session'):
+                    local.session = requests.Session()
+                start = time.perf_counter()
+                response = local.session.post(
+                    f'{url}/auth/google',
+                    json={'credential': credentials[i % len(credentials)]})
+                return time.perf_counter() - start, response.status_code
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(args.concurrency) as pool:
+                results = list(pool.map(login, range(args.logins)))
+            wall = time.perf_counter() - start
+        finally:
+            stop([server])
+            stub.shutdown()
+
+    stats = percentiles([elapsed for elapsed, _ in results])
+    failed = sum(1 for _, status in results if status != 200)
+    print(f'logins:        {len(results)} ({failed} failed)')
+    print(f'logins/s:      {len(results) / wall:.1f}')
+    print(f"p50 ms:        {stats['p50_ms']:.2f}")
+    print(f"p95 ms:        {stats['p95_ms']:.2f}")
+    print(f"p99 ms:        {stats['p99_ms']:.2f}")
+    print(f'cert fetches:  {stub.hits}')
+
+
+if __name__ == '__main__':
+    main()
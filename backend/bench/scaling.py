@@ -0,0 +1,156 @@
+"""Concurrent game throughput as the number of server processes grows.
+
+Starts the local message queue broker and N copies of app.py on
+consecutive ports (each with its own SQLite database), then plays the given
+number of concurrent 10-round games with the two players of every game
+connected to different processes, so that the cross-process event routing
+is exercised. Run from the backend directory:
+
+    pip install -r bench/requirements.txt
+    python bench/scaling.py --workers 1 2 4 --games 100
+
+Clients are assigned to servers round-robin, which is what sticky routing
+in front of the workers would do for a real deployment.
+"""
+import argparse
+import queue
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import socketio
+
+from common import BACKEND_DIR, SECRET_KEY, percentiles, start_app, stop
+
+sys.path.insert(0, BACKEND_DIR)
+
+from auth import SessionTokens  # noqa: E402
+
+ROUNDS = 10
+session_tokens = SessionTokens(SECRET_KEY)
+
+
+def start_servers(count, base_port, broker_port, workdir):
+    procs = [subprocess.Popen(
+        [sys.executable, 'message_queue.py', '--port', str(broker_port)],
+        cwd=BACKEND_DIR)]
+    time.sleep(0.5)
+    for i in range(count):
+        procs.append(start_app(
+            base_port + i, workdir, name=f'bench_{i}',
+            SOCKETIO_MESSAGE_QUEUE=f'local://127.0.0.1:{broker_port}'))
+    # Let the processes exchange heartbeats before routing games
+    time.sleep(1)
+    return procs
+
+
+class Player:
+    def __init__(self, url, user_id, transport):
+        self.user_id = user_id
+        self.events = queue.Queue()
+        self.sio = socketio.Client(serializer='msgpack')
+        for name in ('game_created', 'game_joined', 'card_check_result',
+                     'error'):
+            self.sio.on(name, self._recorder(name))
+        token = session_tokens.issue(user_id, f'{user_id}@bench.local')
+        self.sio.connect(url, transports=[transport], auth={'token': token})
+
+    def _recorder(self, name):
+        return lambda data: self.events.put((name, data))
+
+    def wait(self, name, timeout=30):
+        while True:
+            event, data = self.events.get(timeout=timeout)
+            if event == 'error':
+                raise RuntimeError(data['message'])
+            if event == name:
+                return data
+
+
+def play_game(index, urls, transport, latencies):
+    sender = Player(urls[index % len(urls)], f'sender_{index}', transport)
+    receiver = Player(urls[(index + 1) % len(urls)], f'receiver_{index}',
+                      transport)
+    try:
+        sender.sio.emit('create_game', {'sender_id': sender.user_id})
+        game_id = sender.wait('game_created')['game_id']
+        for player in (sender, receiver):
+            player.sio.emit('join_game', {'game_id': game_id,
+                                          'user_id': player.user_id})
+            player.wait('game_joined')
+        for round_number in range(ROUNDS):
+            start = time.perf_counter()
+            for player in (sender, receiver):
+                player.sio.emit('card_selected', {
+                    'game_id': game_id,
+                    'user_id': player.user_id,
+                    'card_index': (index + round_number) % 8
+                })
+            for player in (sender, receiver):
+                player.wait('card_check_result')
+            latencies.append(time.perf_counter() - start)
+    finally:
+        sender.sio.disconnect()
+        receiver.sio.disconnect()
+
+
+def run(workers, games, transport, base_port, broker_port):
+    with tempfile.TemporaryDirectory() as workdir:
+        procs = start_servers(workers, base_port, broker_port, workdir)
+        try:
+            urls = [f'http://127.0.0.1:{base_port + i}'
+                    for i in range(workers)]
+            latencies, failures = [], []
+
+            def worker(i):
+                try:
+                    play_game(i, urls, transport, latencies)
+                except Exception as e:
+                    failures.append(e)
+
+            threads = [threading.Thread(target=worker, args=(i,))
+                       for i in range(games)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+        finally:
+            stop(procs)
+
+    stats = percentiles(latencies)
+    return {
+        'workers': workers,
+        'games': games,
+        'failed': len(failures),
+        'games_per_sec': (games - len(failures)) / elapsed,
+        'round_p50_ms': stats.get('p50_ms', float('nan')),
+        'round_p99_ms': stats.get('p99_ms', float('nan')),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--games', type=int, default=50)
+    parser.add_argument('--transport', default='websocket',
+                        choices=['websocket', 'polling'])
+    parser.add_argument('--base-port', type=int, default=5100)
+    parser.add_argument('--broker-port', type=int, default=6390)
+    args = parser.parse_args()
+
+    print(f"{'workers':>8} {'games':>6} {'failed':>6} {'games/s':>8} "
+          f"{'p50 ms':>8} {'p99 ms':>8}")
+    for workers in args.workers:
+        r = run(workers, args.games, args.transport, args.base_port,
+                args.broker_port)
+        print(f"{r['workers']:>8} {r['games']:>6} {r['failed']:>6} "
+              f"{r['games_per_sec']:>8.2f} {r['round_p50_ms']:>8.1f} "
+              f"{r['round_p99_ms']:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,378 @@
+"""In-memory round engine for live games.
+
+Live games are held in compact GameState objects keyed by game_id and card
+picks are resolved entirely in memory. Finished rounds, game status
+changes, per-player results of finished games and running hit totals per
+pair of players are queued on a WriteBehind buffer that a background task
+flushes to the database in batched commits.
+
+Games leave memory once they have been idle for too long: pending and
+active games are expired, finished ones are simply dropped. A bounded set
+of tombstones keeps the final status of recently removed games, so late events
+for them get a clear error without a database lookup.
+"""
+import time
+from array import array
+from collections import OrderedDict
+from datetime import datetime
+
+ROUNDS_PER_GAME = 10
+CARD_COUNT = 8
+NO_PICK = -1
+
+SENDER = 0
+RECEIVER = 1
+
+
+class GameError(Exception):
+    """Raised for invalid game actions; the message is safe to show clients."""
+
+
+class GameState:
+    __slots__ = ('game_id', 'sender_id', 'receiver_id', 'status', 'round',
+                 'score', 'picks', 'history', 'persisted', 'updated_at')
+
+    def __init__(self, game_id, sender_id, receiver_id=None, status='pending',
+                 persisted=False):
+        self.game_id = game_id
+        self.sender_id = sender_id
+        self.receiver_id = receiver_id
+        self.status = status
+        self.round = 0
+        self.score = 0
+        # Current round's picks, indexed by SENDER / RECEIVER
+        self.picks = array('b', (NO_PICK, NO_PICK))
+        # Finished rounds as flat (sender_card, receiver_card) pairs
+        self.history = array('b')
+        self.persisted = persisted
+        self.updated_at = time.time()
+
+    def seat(self, user_id):
+        if user_id == self.sender_id:
+            return SENDER
+        if user_id is not None and user_id == self.receiver_id:
+            return RECEIVER
+        return None
+
+    def to_row(self):
+        return {
+            'id': self.game_id,
+            'sender_id': self.sender_id,
+            'receiver_id': self.receiver_id,
+            'status': self.status,
+            'updated_at': datetime.utcfromtimestamp(self.updated_at),
+        }
+
+
+class RoundEngine:
+    """Authoritative state for every live game handled by this process."""
+
+    def __init__(self, write_behind=None, max_tombstones=10000):
+        self.games = {}
+        self.write_behind = write_behind
+        self.max_tombstones = max_tombstones
+        self._tombstones = OrderedDict()
+
+    def __len__(self):
+        return len(self.games)
+
+    def get(self, game_id):
+        return self.games.get(game_id)
+
+    def create(self, game_id, sender_id):
+        if game_id in self.games:
+            raise GameError('Game already exists')
+        state = GameState(game_id, sender_id)
+        self.games[game_id] = state
+        self._mark(state)
+        return state
+
+    def adopt(self, game_id, sender_id, receiver_id, status, rounds=()):
+        """Load a game that already exists in the database.
+
+        Loading waits on the database, so another event may have adopted the
+        game meanwhile; that state may already hold newer moves and is kept.
+        """
+        state = self.games.get(game_id)
+        if state is not None:
+            return state
+        state = GameState(game_id, sender_id, receiver_id, status,
+                          persisted=True)
+        for sender_card, receiver_card in rounds:
+            state.history.append(sender_card)
+            state.history.append(receiver_card)
+            state.score += sender_card == receiver_card
+        state.round = len(state.history) // 2
+        self.games[game_id] = state
+        return state
+
+    def evict(self, game_id):
+        return self.games.pop(game_id, None)
+
+    def bury(self, game_id, status):
+        """Remember that ``game_id`` ended with ``status``."""
+        self._tombstones[game_id] = status
+        self._tombstones.move_to_end(game_id)
+        while len(self._tombstones) > self.max_tombstones:
+            self._tombstones.popitem(last=False)
+
+    def ended(self, game_id):
+        """The final status of a recently removed game, or None."""
+        return self._tombstones.get(game_id)
+
+    def expire(self, now, idle_limits):
+        """Remove games idle for longer than ``idle_limits[status]`` seconds.
+
+        Pending and active games that time out are marked expired first, so
+        the write-behind records it. Returns the ids removed from memory.
+        """
+        removed = []
+        for game_id, state in list(self.games.items()):
+            limit = idle_limits.get(state.status)
+            if limit is None or now - state.updated_at <= limit:
+                continue
+            if state.status in ('pending', 'active'):
+                state.status = 'expired'
+                self._mark(state)
+            del self.games[game_id]
+            self.bury(game_id, state.status)
+            removed.append(game_id)
+        return removed
+
+    def join(self, game_id, user_id):
+        state = self._require(game_id)
+        if state.seat(user_id) is not None:
+            return state
+        if state.receiver_id is not None:
+            raise GameError('Game is full')
+        if state.status != 'pending':
+            raise GameError(f'Game is {state.status}')
+        state.receiver_id = user_id
+        state.status = 'active'
+        self._mark(state)
+        return state
+
+    def pick(self, game_id, user_id, card_index):
+        """Record a pick and return the finished round, if this pick ended it.
+
+        The result is a (round_number, sender_card, receiver_card, is_correct)
+        tuple, or None while the other player has yet to pick.
+        """
+        state = self._require(game_id)
+        if state.status != 'active':
+            raise GameError(f'Game is {state.status}')
+        seat = state.seat(user_id)
+        if seat is None:
+            raise GameError('Not a player in this game')
+        if not 0 <= card_index < CARD_COUNT:
+            raise GameError('Invalid card')
+        picks = state.picks
+        if picks[seat] != NO_PICK:
+            raise GameError('Card already selected this round')
+        picks[seat] = card_index
+        # Every pick keeps the game row's updated_at current for the reaper,
+        # including a first pick that is still waiting on the other player
+        self._mark(state)
+        if picks[SENDER] == NO_PICK or picks[RECEIVER] == NO_PICK:
+            return None
+
+        sender_card, receiver_card = picks[SENDER], picks[RECEIVER]
+        is_correct = sender_card == receiver_card
+        state.history.append(sender_card)
+        state.history.append(receiver_card)
+        state.round += 1
+        state.score += is_correct
+        picks[SENDER] = picks[RECEIVER] = NO_PICK
+        result = (state.round, sender_card, receiver_card, is_correct)
+        if state.round >= ROUNDS_PER_GAME:
+            state.status = 'finished'
+        if self.write_behind is not None:
+            self.write_behind.add_round(state, result)
+            if state.status == 'finished':
+                self.write_behind.finish(state)
+        return result
+
+    def _require(self, game_id):
+        state = self.games.get(game_id)
+        if state is None:
+            status = self._tombstones.get(game_id)
+            raise GameError(f'Game is {status}' if status else 'Game not found')
+        return state
+
+    def _mark(self, state):
+        state.updated_at = time.time()
+        if self.write_behind is not None:
+            self.write_behind.mark(state)
+
+
+class WriteBehind:
+    """Batches game and round writes and hands them to ``flush`` in one go.
+
+    ``flush(new_games, updated_games, rounds, results, pairs)`` receives lists
+    of row dicts plus the totals to add per pair of players, a dict of
+    ``(user_a, user_b)`` (sorted) to ``[games, rounds, hits]``, and must
+    commit them as a single transaction. A failed flush puts the batch back
+    so it is retried on the next pass.
+
+    ``is_row_error(e)`` tells failures caused by the rows themselves, such as
+    an integrity error, from ones worth retrying as they are, such as the
+    database being unreachable. After ``max_retries`` row errors in a row the
+    queue is flushed one game at a time and games that still fail are
+    dropped and passed to ``on_drop(game_id, rows, error)``, so one bad row
+    cannot hold back every other game.
+    """
+
+    def __init__(self, flush, interval=1.0, max_retries=3,
+                 is_row_error=None, on_drop=None):
+        self._flush = flush
+        self.interval = interval
+        self.max_retries = max_retries
+        self.is_row_error = is_row_error or (lambda e: True)
+        self.on_drop = on_drop
+        self.dropped = 0
+        self._failures = 0
+        self._games = {}
+        self._rounds = []
+        self._results = []
+        self._pairs = {}
+
+    def __len__(self):
+        return len(self._games) + len(self._rounds) + len(self._results)
+
+    def mark(self, state):
+        self._games[state.game_id] = state
+
+    def add_round(self, state, result):
+        round_number, sender_card, receiver_card, is_correct = result
+        self._rounds.append({
+            'game_id': state.game_id,
+            'round_number': round_number,
+            'sender_card': sender_card,
+            'receiver_card': receiver_card,
+            'is_correct': is_correct,
+            'finished_at': datetime.utcnow(),
+        })
+        totals = self._pair_totals(self._pairs, state)
+        totals[1] += 1
+        totals[2] += is_correct
+
+    def finish(self, state):
+        """Queue a finished game's result row for each of its players."""
+        finished_at = datetime.utcnow()
+        for user_id, partner_id, role in (
+                (state.sender_id, state.receiver_id, 'sender'),
+                (state.receiver_id, state.sender_id, 'receiver')):
+            self._results.append({
+                'user_id': user_id,
+                'game_id': state.game_id,
+                'partner_id': partner_id,
+                'role': role,
+                'rounds': state.round,
+                'hits': state.score,
+                'finished_at': finished_at,
+            })
+        self._pair_totals(self._pairs, state)[0] += 1
+
+    @staticmethod
+    def _pair_totals(pairs, state):
+        key = tuple(sorted((state.sender_id, state.receiver_id)))
+        totals = pairs.get(key)
+        if totals is None:
+            totals = pairs[key] = [0, 0, 0]
+        return totals
+
+    def flush(self):
+        if not self._games and not self._rounds and not self._results:
+            return 0
+        batch = self._take()
+        try:
+            self._write(batch)
+        except Exception as e:
+            self._put_back(batch)
+            if self.is_row_error(e):
+                self._failures += 1
+                if self._failures >= self.max_retries:
+                    self._failures = 0
+                    return self._flush_each_game()
+            raise
+        self._failures = 0
+        return self._size(batch)
+
+    def _take(self):
+        batch = self._games, self._rounds, self._results, self._pairs
+        self._games, self._rounds, self._results, self._pairs = {}, [], [], {}
+        return batch
+
+    def _write(self, batch):
+        games, rounds, results, pairs = batch
+        new_games, updated_games = [], []
+        for state in games.values():
+            (updated_games if state.persisted else new_games).append(
+                state.to_row())
+        self._flush(new_games, updated_games, rounds, results, pairs)
+        for state in games.values():
+            state.persisted = True
+
+    def _put_back(self, batch):
+        games, rounds, results, pairs = batch
+        for game_id, state in games.items():
+            self._games.setdefault(game_id, state)
+        self._rounds[:0] = rounds
+        self._results[:0] = results
+        for key, totals in pairs.items():
+            merged = self._pairs.setdefault(key, [0, 0, 0])
+            for i, n in enumerate(totals):
+                merged[i] += n
+
+    @staticmethod
+    def _size(batch):
+        games, rounds, results, _ = batch
+        return len(games) + len(rounds) + len(results)
+
+    def _flush_each_game(self):
+        """Write the queue as one batch per game, dropping games that fail."""
+        games, rounds, results, _ = self._take()
+        batches = {game_id: ({game_id: state}, [], [], {})
+                   for game_id, state in games.items()}
+        for index, rows in ((1, rounds), (2, results)):
+            for row in rows:
+                batches.setdefault(row['game_id'], ({}, [], [], {}))[
+                    index].append(row)
+        # Split the pair totals the same way add_round and finish built them
+        for game_id, (one_game, one_rounds, one_results, pairs) in \
+                batches.items():
+            state = one_game.get(game_id)
+            if state is not None and (one_rounds or one_results):
+                totals = self._pair_totals(pairs, state)
+                totals[0] += bool(one_results)
+                totals[1] += len(one_rounds)
+                totals[2] += sum(row['is_correct'] for row in one_rounds)
+
+        written = 0
+        pending = list(batches.items())
+        for i, (game_id, batch) in enumerate(pending):
+            try:
+                self._write(batch)
+            except Exception as e:
+                if not self.is_row_error(e):
+                    for _, rest in pending[i:]:
+                        self._put_back(rest)
+                    raise
+                self.dropped += 1
+                if self.on_drop is not None:
+                    one_game, one_rounds, one_results, _ = batch
+                    self.on_drop(game_id, [state.to_row() for state in
+                                           one_game.values()] +
+                                 one_rounds + one_results, e)
+                continue
+            written += self._size(batch)
+        return written
+
+    def run(self, sleep, on_error=None):
+        while True:
+            sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                if on_error is not None:
+                    on_error(e)
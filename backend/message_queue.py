@@ -0,0 +1,293 @@
+"""Message queue backends for running several Socket.IO servers together.
+
+Every server process publishes its emits on a shared channel so that events
+reach clients connected to any other process. Game state stays in the
+memory of the process that created the game (its "owner"); the owner's
+shard key is embedded in the game id and events for a game that arrive on
+another process are forwarded to the owner over the same channel.
+
+Supported ``SOCKETIO_MESSAGE_QUEUE`` URLs:
+
+* ``postgresql://...`` - Postgres LISTEN/NOTIFY on the application database
+* ``redis://...`` - Redis pub/sub (requires the ``redis`` package)
+* ``local://host:port`` - the stand-in broker below, for local testing::
+
+      python message_queue.py --port 6390
+"""
+import os
+import pickle
+import select
+import socket
+import socketserver
+import threading
+import time
+
+from engineio import json
+from socketio import PubSubManager, RedisManager
+
+try:
+    import psycopg2
+    import psycopg2.extensions
+except ImportError:
+    psycopg2 = None
+
+SHARD_KEY_LENGTH = 8
+
+
+def decode_message(message):
+    if isinstance(message, dict):
+        return message
+    if isinstance(message, bytes):
+        try:
+            return pickle.loads(message)
+        except Exception:
+            pass
+    try:
+        return json.loads(message)
+    except Exception:
+        return None
+
+
+class GameRouting:
+    """Mixin that adds owner-routed game events to a pub/sub manager.
+
+    Events can also be broadcast to every other process, for state that is
+    not owned by a single game such as which users are online.
+    """
+
+    heartbeat_interval = 5
+    peer_timeout = 15
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.shard = self.host_id[:SHARD_KEY_LENGTH]
+        # Called as game_handler(event, sid, data) for events forwarded here
+        self.game_handler = None
+        self.peers = {}
+
+    def initialize(self):
+        super().initialize()
+        if not self.write_only:
+            self.server.start_background_task(self._heartbeat)
+
+    def is_alive(self, shard):
+        last_seen = self.peers.get(shard)
+        return last_seen is not None and \
+            time.time() - last_seen < self.peer_timeout
+
+    def forward_game_event(self, shard, event, sid, data):
+        self._publish({'method': 'game_event', 'shard': shard,
+                       'event': event, 'sid': sid, 'data': data})
+
+    def broadcast_game_event(self, event, sid, data):
+        """Run the event on every other process."""
+        self._publish({'method': 'game_event', 'shard': '*',
+                       'origin': self.shard, 'event': event, 'sid': sid,
+                       'data': data})
+
+    def _heartbeat(self):
+        while True:
+            # Until our own heartbeat comes back the listener may not be
+            # subscribed yet, so keep saying hello and ask for replies
+            hello = self.shard not in self.peers
+            self._publish({'method': 'heartbeat', 'shard': self.shard,
+                           'hello': hello})
+            self.server.sleep(0.1 if hello else self.heartbeat_interval)
+
+    def _thread(self):
+        listen = self._listen
+
+        def routed():
+            for message in listen():
+                data = decode_message(message)
+                method = data.get('method') if isinstance(data, dict) \
+                    else None
+                if method == 'heartbeat':
+                    if data.get('hello') and data['shard'] != self.shard:
+                        # Introduce ourselves to a newly started process
+                        self._publish({'method': 'heartbeat',
+                                       'shard': self.shard})
+                    self.peers[data['shard']] = time.time()
+                elif method == 'game_event':
+                    if data['shard'] == self.shard or (
+                            data['shard'] == '*' and
+                            data['origin'] != self.shard):
+                        self._handle_game_event(data)
+                else:
+                    yield message
+
+        self._listen = routed
+        return super()._thread()
+
+    def _handle_game_event(self, data):
+        try:
+            self.game_handler(data['event'], data['sid'], data['data'])
+        except Exception:
+            self._get_logger().exception('Error handling forwarded game event')
+
+
+class PostgresManager(PubSubManager):
+    """Postgres LISTEN/NOTIFY based client manager.
+
+    NOTIFY payloads are limited to 8000 bytes, which comfortably fits the
+    game events this application emits. Under gevent, psycopg2 needs a wait
+    callback (app.py installs psycogreen's) or every publish blocks the
+    whole process; the publishing connection is then shared between
+    greenlets, so publishes take turns on it.
+    """
+    name = 'postgres'
+
+    def __init__(self, url, channel='flask-socketio', write_only=False,
+                 logger=None):
+        if psycopg2 is None:
+            raise RuntimeError('psycopg2 is not installed')
+        self.url = url
+        self._conn = None
+        self._lock = threading.Lock()
+        super().__init__(channel=channel, write_only=write_only,
+                         logger=logger)
+
+    def _connect(self):
+        conn = psycopg2.connect(self.url)
+        conn.set_isolation_level(
+            psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        return conn
+
+    def _publish(self, data):
+        payload = json.dumps(data)
+        with self._lock:
+            for retry in (True, False):
+                try:
+                    if self._conn is None or self._conn.closed:
+                        self._conn = self._connect()
+                    with self._conn.cursor() as cur:
+                        cur.execute('SELECT pg_notify(%s, %s)',
+                                    (self.channel, payload))
+                    return
+                except psycopg2.OperationalError:
+                    self._conn = None
+                    if not retry:
+                        raise
+
+    def _listen(self):
+        while True:
+            try:
+                conn = self._connect()
+                with conn.cursor() as cur:
+                    cur.execute('LISTEN "{}"'.format(
+                        self.channel.replace('"', '""')))
+                while True:
+                    select.select([conn], [], [], 5)
+                    conn.poll()
+                    while conn.notifies:
+                        yield conn.notifies.pop(0).payload
+            except psycopg2.OperationalError:
+                self._get_logger().error(
+                    'Postgres listener disconnected, retrying in 1s')
+                time.sleep(1)
+
+
+class LocalManager(PubSubManager):
+    """Client manager for the stand-in broker in this module."""
+    name = 'local'
+
+    def __init__(self, url, channel='flask-socketio', write_only=False,
+                 logger=None):
+        host, _, port = url.split('://', 1)[1].rpartition(':')
+        self.address = (host or '127.0.0.1', int(port))
+        self._writer = None
+        super().__init__(channel=channel, write_only=write_only,
+                         logger=logger)
+
+    def _publish(self, data):
+        line = json.dumps(data).encode('utf-8') + b'\n'
+        for retry in (True, False):
+            try:
+                if self._writer is None:
+                    self._writer = socket.create_connection(self.address)
+                self._writer.sendall(line)
+                return
+            except OSError:
+                self._writer = None
+                if not retry:
+                    raise
+
+    def _listen(self):
+        while True:
+            try:
+                sock = socket.create_connection(self.address)
+                sock.sendall(b'SUBSCRIBE\n')
+                for line in sock.makefile('rb'):
+                    yield line
+            except OSError:
+                self._get_logger().error(
+                    'Local broker disconnected, retrying in 1s')
+                time.sleep(1)
+
+
+class RoutedPostgresManager(GameRouting, PostgresManager):
+    pass
+
+
+class RoutedLocalManager(GameRouting, LocalManager):
+    pass
+
+
+class RoutedRedisManager(GameRouting, RedisManager):
+    pass
+
+
+def make_client_manager(url, channel='flask-socketio'):
+    if url.startswith(('postgres://', 'postgresql://')):
+        return RoutedPostgresManager(url, channel=channel)
+    if url.startswith(('redis://', 'rediss://')):
+        return RoutedRedisManager(url, channel=channel)
+    if url.startswith('local://'):
+        return RoutedLocalManager(url, channel=channel)
+    raise ValueError(f'Unsupported message queue URL: {url}')
+
+
+class _BrokerHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        broker = self.server
+        for line in self.rfile:
+            if line == b'SUBSCRIBE\n':
+                with broker.lock:
+                    broker.subscribers.append(self.wfile)
+                continue
+            with broker.lock:
+                for wfile in list(broker.subscribers):
+                    try:
+                        wfile.write(line)
+                        wfile.flush()
+                    except OSError:
+                        broker.subscribers.remove(wfile)
+
+    def finish(self):
+        with self.server.lock:
+            if self.wfile in self.server.subscribers:
+                self.server.subscribers.remove(self.wfile)
+        super().finish()
+
+
+class LocalBroker(socketserver.ThreadingTCPServer):
+    """Fan-out broker: every published line goes to every subscriber."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, _BrokerHandler)
+        self.lock = threading.Lock()
+        self.subscribers = []
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Local message queue broker')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int,
+                        default=int(os.getenv('BROKER_PORT', 6390)))
+    args = parser.parse_args()
+    with LocalBroker((args.host, args.port)) as broker:
+        broker.serve_forever()
@@ -0,0 +1,123 @@
+"""Which users are connected to this process, and invitations for those who aren't.
+
+Presence indexes live sids by user_id and by email so that an event for a
+user can be sent straight to each of their tabs. Invitations for users who
+are offline wait in a bounded Inbox until the user connects again or the
+invitation expires.
+"""
+import time
+from collections import OrderedDict, deque
+
+
+def normalize_email(email):
+    return email.strip().lower()
+
+
+class Presence:
+    def __init__(self):
+        self._users = {}
+        self._sids_by_user = {}
+        self._sids_by_email = {}
+
+    def __len__(self):
+        return len(self._users)
+
+    def add(self, sid, user_id, email):
+        email = normalize_email(email)
+        self._users[sid] = {'user_id': user_id, 'email': email,
+                            'game_id': None}
+        self._sids_by_user.setdefault(user_id, set()).add(sid)
+        self._sids_by_email.setdefault(email, set()).add(sid)
+
+    def remove(self, sid):
+        user = self._users.pop(sid, None)
+        if user is None:
+            return None
+        for index, key in ((self._sids_by_user, user['user_id']),
+                           (self._sids_by_email, user['email'])):
+            sids = index.get(key)
+            if sids is not None:
+                sids.discard(sid)
+                if not sids:
+                    del index[key]
+        return user
+
+    def user(self, sid):
+        return self._users.get(sid)
+
+    def set_game(self, sid, game_id):
+        """Remember the game a connection last joined."""
+        user = self._users.get(sid)
+        if user is not None:
+            user['game_id'] = game_id
+
+    def sids_for_user(self, user_id):
+        return self._sids_by_user.get(user_id, ())
+
+    def sids_for_email(self, email):
+        return self._sids_by_email.get(normalize_email(email), ())
+
+
+class Inbox:
+    """Pending invitations per email, bounded in size and age.
+
+    Each email keeps at most ``per_user`` invitations (oldest dropped first)
+    and at most ``max_users`` emails have an inbox at all, least recently
+    used dropped first. Invitations expire ``ttl`` seconds after they were
+    held.
+    """
+
+    def __init__(self, per_user=20, max_users=10000, ttl=24 * 3600):
+        self.per_user = per_user
+        self.max_users = max_users
+        self.ttl = ttl
+        self._boxes = OrderedDict()
+
+    def __len__(self):
+        return len(self._boxes)
+
+    def hold(self, email, invitation):
+        email = normalize_email(email)
+        box = self._boxes.get(email)
+        if box is None:
+            box = self._boxes[email] = deque(maxlen=self.per_user)
+            while len(self._boxes) > self.max_users:
+                self._boxes.popitem(last=False)
+        else:
+            self._boxes.move_to_end(email)
+        box.append((time.time() + self.ttl, invitation))
+
+    def drain(self, email):
+        """Remove and return every unexpired invitation for ``email``."""
+        box = self._boxes.pop(normalize_email(email), None)
+        if not box:
+            return []
+        now = time.time()
+        return [invitation for expires, invitation in box if expires > now]
+
+    def discard(self, email, game_id):
+        email = normalize_email(email)
+        box = self._boxes.get(email)
+        if box is None:
+            return
+        kept = [item for item in box if item[1]['game_id'] != game_id]
+        if kept:
+            box.clear()
+            box.extend(kept)
+        else:
+            del self._boxes[email]
+
+    def expire(self):
+        now = time.time()
+        for email in list(self._boxes):
+            box = self._boxes[email]
+            # Invitations are appended in order, so expired ones are in front
+            while box and box[0][0] <= now:
+                box.popleft()
+            if not box:
+                del self._boxes[email]
+
+    def run(self, sleep, interval=60):
+        while True:
+            sleep(interval)
+            self.expire()
@@ -0,0 +1,127 @@
+"""Hit rates against the chance baseline.
+
+A round is a hit when the receiver picks the sender's card, which happens
+by chance one time in CARD_COUNT. Totals of games, rounds and hits are kept
+per user and per pair of players and only ever added to as rounds are
+flushed, so reading them never scans history. The significance score is the
+z-score of the hit count under that baseline, with the one-sided binomial
+tail probability alongside it.
+
+``recompute_totals`` rebuilds every total from per-game rows in one pass,
+for backfills; it is vectorized with NumPy when that is installed.
+"""
+import math
+
+from game_engine import CARD_COUNT
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+CHANCE = 1 / CARD_COUNT
+# Above this many rounds the exact tail sum gives way to the normal approximation
+EXACT_TAIL_LIMIT = 1000
+
+
+def pair_key(user_id, partner_id):
+    return (user_id, partner_id) if user_id <= partner_id \
+        else (partner_id, user_id)
+
+
+def z_score(hits, rounds, p=CHANCE):
+    if not rounds:
+        return 0.0
+    return (hits - rounds * p) / math.sqrt(rounds * p * (1 - p))
+
+
+def p_value(hits, rounds, p=CHANCE):
+    """Probability of at least ``hits`` hits in ``rounds`` rounds by chance."""
+    if hits <= 0:
+        return 1.0
+    if rounds > EXACT_TAIL_LIMIT:
+        # Normal approximation with continuity correction
+        z = (hits - 0.5 - rounds * p) / math.sqrt(rounds * p * (1 - p))
+        return 0.5 * math.erfc(z / math.sqrt(2))
+    log_p, log_q = math.log(p), math.log1p(-p)
+    log_n = math.lgamma(rounds + 1)
+    # Terms shrink away from the mean, so sum whichever tail lies beyond
+    # ``hits`` and stop once the rest no longer matters
+    upper = hits > rounds * p
+    tail = 0.0
+    for k in (range(hits, rounds + 1) if upper else range(hits - 1, -1, -1)):
+        term = math.exp(log_n - math.lgamma(k + 1) -
+                        math.lgamma(rounds - k + 1) +
+                        k * log_p + (rounds - k) * log_q)
+        tail += term
+        if term < tail * 1e-12:
+            break
+    return min(1.0, tail) if upper else max(0.0, 1.0 - tail)
+
+
+def summary(games=0, rounds=0, hits=0):
+    return {
+        'games': games,
+        'rounds': rounds,
+        'hits': hits,
+        'hit_rate': round(hits / rounds, 4) if rounds else None,
+        'chance': CHANCE,
+        'z_score': round(z_score(hits, rounds), 3),
+        'p_value': p_value(hits, rounds),
+    }
+
+
+def user_totals(pairs):
+    """Per-user totals from per-pair ones; a pair's games count for both."""
+    per_user = {}
+    for pair, counts in pairs.items():
+        for user_id in pair:
+            total = per_user.get(user_id, (0, 0, 0))
+            per_user[user_id] = tuple(t + c for t, c in zip(total, counts))
+    return per_user
+
+
+def recompute_totals(senders, receivers, finished, rounds, hits):
+    """Sum per-game columns into totals per pair of players and per user.
+
+    Each argument is a sequence with one entry per game. Returns two dicts,
+    ``{(user_a, user_b): (games, rounds, hits)}`` keyed by ``pair_key`` and
+    ``{user_id: (games, rounds, hits)}``.
+    """
+    if not len(senders):
+        return {}, {}
+    if np is None:
+        return _totals_python(senders, receivers, finished, rounds, hits)
+
+    columns = [np.asarray(c, dtype=np.int64) for c in (finished, rounds, hits)]
+    users, codes = np.unique(np.concatenate([np.asarray(senders, dtype=str),
+                                             np.asarray(receivers, dtype=str)]),
+                             return_inverse=True)
+    codes = codes.reshape(2, -1)
+    # np.unique sorts like Python does, so the lower code is pair_key's first id
+    keys = codes.min(axis=0) * len(users) + codes.max(axis=0)
+    pair_keys, pair_index = np.unique(keys, return_inverse=True)
+    pair_sums = [np.bincount(pair_index, weights=c, minlength=len(pair_keys))
+                 for c in columns]
+    # Every game counts towards both of its players
+    user_index = codes.ravel()
+    user_sums = [np.bincount(user_index, weights=np.tile(c, 2),
+                             minlength=len(users)) for c in columns]
+
+    pairs = {(str(users[key // len(users)]), str(users[key % len(users)])):
+             (int(g), int(r), int(h))
+             for key, g, r, h in zip(pair_keys.tolist(), *pair_sums)}
+    per_user = {str(user): (int(g), int(r), int(h))
+                for user, g, r, h in zip(users, *user_sums)}
+    return pairs, per_user
+
+
+def _totals_python(senders, receivers, finished, rounds, hits):
+    pairs, per_user = {}, {}
+    for row in zip(senders, receivers, finished, rounds, hits):
+        sender, receiver, counts = row[0], row[1], row[2:]
+        for index, key in ((pairs, pair_key(sender, receiver)),
+                           (per_user, sender), (per_user, receiver)):
+            total = index.get(key, (0, 0, 0))
+            index[key] = tuple(t + int(c) for t, c in zip(total, counts))
+    return pairs, per_user
@@ -0,0 +1,200 @@
+"""Low-overhead logging and latency metrics.
+
+Log records are handed to a queue and formatted and written by a native
+background thread, so a handler never waits on log I/O or on string
+formatting. High-frequency event logs can be sampled. Metrics keeps a call
+counter and a log-linear latency histogram for each timed operation, plus
+plain counters and gauges, served as JSON by the ``/metrics`` endpoint.
+"""
+import functools
+import logging
+import sys
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+from logging.handlers import QueueHandler
+
+try:
+    # gevent patches queue.SimpleQueue into a greenlet queue, which the
+    # native writer thread below cannot wait on; keep the original
+    from gevent.monkey import get_original
+    SimpleQueue = get_original('queue', 'SimpleQueue')
+except ImportError:
+    from queue import SimpleQueue
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+
+class DeferredQueueHandler(QueueHandler):
+    """Queues the record as is; the writer thread does the formatting."""
+
+    def prepare(self, record):
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """Lets one in ``every`` record below WARNING through."""
+
+    def __init__(self, every):
+        super().__init__()
+        self.every = max(1, every)
+        self._seen = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        self._seen += 1
+        return self._seen % self.every == 0
+
+
+def _start_native_thread(target):
+    # Under gevent's monkey patching threading.Thread is a greenlet, which
+    # would still write logs on the event loop; the hub's threadpool is not.
+    try:
+        from gevent import get_hub
+        from gevent.monkey import is_module_patched
+        if is_module_patched('threading'):
+            get_hub().threadpool.spawn(target)
+            return
+    except ImportError:
+        pass
+    threading.Thread(target=target, daemon=True).start()
+
+
+def configure_logging(level='INFO', stream=None):
+    """Route all logging through a queue drained by a background writer."""
+    records = SimpleQueue()
+    writer = logging.StreamHandler(stream or sys.stderr)
+    writer.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    def drain():
+        while True:
+            record = records.get()
+            if record is None:
+                break
+            writer.handle(record)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(DeferredQueueHandler(records))
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    _start_native_thread(drain)
+    return records
+
+
+class LatencyHistogram:
+    """Log-linear histogram of microsecond latencies, in the style of HDR.
+
+    Values below 32us get exact buckets; above that each power of two is
+    split into 16 linear buckets, so percentiles are within about 6%.
+    """
+    SUB_BUCKETS = 16
+    MAX_SHIFT = 31
+
+    def __init__(self):
+        self.counts = array('Q', bytes(8 * self.SUB_BUCKETS *
+                                       (self.MAX_SHIFT + 2)))
+        self.total = 0
+        self.sum = 0
+        self.max = 0
+
+    def record(self, micros):
+        micros = int(micros)
+        shift = max(0, micros.bit_length() - 5)
+        if shift > self.MAX_SHIFT:
+            index = len(self.counts) - 1
+        else:
+            index = self.SUB_BUCKETS * shift + (micros >> shift)
+        self.counts[index] += 1
+        self.total += 1
+        self.sum += micros
+        if micros > self.max:
+            self.max = micros
+
+    def _bucket_value(self, index):
+        if index < 2 * self.SUB_BUCKETS:
+            return index
+        shift = index // self.SUB_BUCKETS - 1
+        return (index - self.SUB_BUCKETS * shift) << shift
+
+    def percentile(self, p):
+        if not self.total:
+            return 0
+        rank = max(1, int(self.total * p / 100 + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self._bucket_value(index), self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.total,
+            'mean_ms': round(self.sum / self.total / 1000, 3)
+            if self.total else 0,
+            'p50_ms': self.percentile(50) / 1000,
+            'p90_ms': self.percentile(90) / 1000,
+            'p99_ms': self.percentile(99) / 1000,
+            'p999_ms': self.percentile(99.9) / 1000,
+            'max_ms': self.max / 1000,
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self.started = time.time()
+        self.histograms = {}
+        self.errors = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def observe(self, name, seconds, error=False):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = LatencyHistogram()
+        histogram.record(seconds * 1e6)
+        if error:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    @contextmanager
+    def timer(self, name):
+        """Record the latency of the ``with`` block under ``name``."""
+        start = time.perf_counter()
+        error = True
+        try:
+            yield
+            error = False
+        finally:
+            self.observe(name, time.perf_counter() - start, error)
+
+    def timed(self, name):
+        """Decorator recording the wrapped function's latency under ``name``."""
+        def decorator(f):
+            @functools.wraps(f)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return f(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, read):
+        """Report ``read()`` under ``name`` each time metrics are collected."""
+        self.gauges[name] = read
+
+    def snapshot(self):
+        events = {}
+        for name, histogram in sorted(self.histograms.items()):
+            events[name] = dict(histogram.summary(),
+                                errors=self.errors.get(name, 0))
+        return {
+            'uptime_seconds': round(time.time() - self.started, 1),
+            'counters': dict(self.counters),
+            'gauges': {name: read() for name, read in self.gauges.items()},
+            'events': events,
+        }
@@ -0,0 +1,208 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+from google.auth import exceptions
+from itsdangerous import TimestampSigner
+from requests.structures import CaseInsensitiveDict
+
+import auth
+from auth import CachingRequest, GoogleTokenVerifier, SessionTokens
+
+CERTS_URL = 'https://certs.test/certs'
+
+
+class Clock:
+    """Stands in for the time module, for both wall and monotonic time."""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(auth, 'time', clock)
+    return clock
+
+
+class Session:
+    """Stands in for requests.Session, answering every request the same way."""
+
+    def __init__(self, status=200, cache_control='public, max-age=60'):
+        self.status = status
+        self.cache_control = cache_control
+        self.requests = []
+        self.release = None
+
+    def close(self):
+        pass
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url))
+        if self.release is not None:
+            self.release.wait(5)
+        headers = CaseInsensitiveDict()
+        if self.cache_control:
+            headers['Cache-Control'] = self.cache_control
+        return SimpleNamespace(status_code=self.status, headers=headers,
+                               content=b'{}')
+
+
+def test_caching_request_keeps_response_for_max_age(clock):
+    session = Session()
+    request = CachingRequest(session, cacheable=[CERTS_URL])
+    first = request(CERTS_URL)
+    clock.now += 59
+    assert request(CERTS_URL) is first
+    assert len(session.requests) == 1
+    clock.now += 2
+    assert request(CERTS_URL) is not first
+    assert len(session.requests) == 2
+
+
+@pytest.mark.parametrize('status, cache_control', [
+    (200, None), (200, 'no-store'), (500, 'max-age=60'),
+])
+def test_caching_request_needs_max_age_and_success(clock, status,
+                                                   cache_control):
+    session = Session(status, cache_control)
+    request = CachingRequest(session, cacheable=[CERTS_URL])
+    request(CERTS_URL)
+    request(CERTS_URL)
+    assert len(session.requests) == 2
+
+
+def test_caching_request_only_caches_listed_gets(clock):
+    session = Session()
+    request = CachingRequest(session, cacheable=[CERTS_URL])
+    request('https://other.test/')
+    request('https://other.test/')
+    request(CERTS_URL, method='POST')
+    request(CERTS_URL, method='POST')
+    assert len(session.requests) == 4
+
+
+def test_caching_request_fetches_once_for_concurrent_misses(clock):
+    session = Session()
+    session.release = threading.Event()
+    request = CachingRequest(session, cacheable=[CERTS_URL])
+    responses = []
+    threads = [threading.Thread(target=lambda: responses.append(
+        request(CERTS_URL))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    session.release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(session.requests) == 1
+    assert len(responses) == 5
+    assert all(response is responses[0] for response in responses)
+
+
+class Google:
+    """Stands in for id_token.verify_token, with claims per credential."""
+
+    def __init__(self):
+        self.claims = {}
+        self.calls = []
+
+    def verify_token(self, credential, request, audience, certs_url):
+        self.calls.append(credential)
+        assert (audience, certs_url) == ('client', CERTS_URL)
+        return dict(self.claims[credential])
+
+    def sign_in(self, credential, exp, iss='https://accounts.google.com'):
+        self.claims[credential] = {'sub': credential.decode(), 'exp': exp,
+                                   'iss': iss}
+
+
+@pytest.fixture
+def google(monkeypatch):
+    google = Google()
+    monkeypatch.setattr(auth.id_token, 'verify_token', google.verify_token)
+    return google
+
+
+def verifier(**kwargs):
+    return GoogleTokenVerifier('client', certs_url=CERTS_URL,
+                               request=object(), **kwargs)
+
+
+def test_verifier_remembers_credentials_until_exp(clock, google):
+    google.sign_in(b'alice', exp=clock.now + 100)
+    tokens = verifier()
+    assert tokens.verify('alice')['sub'] == 'alice'
+    assert tokens.verify(b'alice')['sub'] == 'alice'
+    assert google.calls == [b'alice']
+    clock.now += 100
+    tokens.verify('alice')
+    assert google.calls == [b'alice', b'alice']
+
+
+def test_verifier_forgets_least_recently_used(clock, google):
+    for name in (b'a', b'b', b'c'):
+        google.sign_in(name, exp=clock.now + 100)
+    tokens = verifier(max_entries=2)
+    tokens.verify(b'a')
+    tokens.verify(b'b')
+    tokens.verify(b'a')
+    tokens.verify(b'c')
+    assert len(tokens._verified) == 2
+    tokens.verify(b'a')
+    tokens.verify(b'b')
+    assert google.calls == [b'a', b'b', b'c', b'b']
+
+
+def test_verifier_rejects_other_issuers(clock, google):
+    google.sign_in(b'mallory', exp=clock.now + 100, iss='https://evil.test')
+    tokens = verifier()
+    for _ in range(2):
+        with pytest.raises(exceptions.GoogleAuthError, match='Wrong issuer'):
+            tokens.verify(b'mallory')
+    assert google.calls == [b'mallory', b'mallory']
+
+
+@pytest.fixture
+def signed_at(monkeypatch):
+    now = [1000]
+    monkeypatch.setattr(TimestampSigner, 'get_timestamp',
+                        lambda self: now[0])
+    return now
+
+
+def test_session_tokens_round_trip(signed_at):
+    tokens = SessionTokens('secret')
+    token = tokens.issue('u1', 'u1@example.com')
+    assert tokens.verify(token) == {'user_id': 'u1',
+                                    'email': 'u1@example.com'}
+
+
+@pytest.mark.parametrize('token', [None, '', 'garbage', 'a.b.c'])
+def test_session_tokens_reject_junk(signed_at, token):
+    assert SessionTokens('secret').verify(token) is None
+
+
+def test_session_tokens_reject_tampering(signed_at):
+    tokens = SessionTokens('secret')
+    token = tokens.issue('u1', 'u1@example.com')
+    # Another user's payload under this token's timestamp and signature
+    forged = tokens.issue('u2', 'u2@example.com').partition('.')[0] + \
+        '.' + token.partition('.')[2]
+    assert tokens.verify(forged) is None
+    assert SessionTokens('other secret').verify(token) is None
+
+
+def test_session_tokens_expire(signed_at):
+    tokens = SessionTokens('secret', max_age=60)
+    token = tokens.issue('u1', 'u1@example.com')
+    signed_at[0] += 60
+    assert tokens.verify(token) is not None
+    signed_at[0] += 1
+    assert tokens.verify(token) is None
@@ -0,0 +1,198 @@
+import pytest
+
+from backpressure import (DEFAULT_RATE_LIMITS, Outbox, RateLimiter,
+                          parse_limits)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Client:
+    """Stands in for the Engine.IO side: what was sent and what is queued."""
+
+    def __init__(self):
+        self.sent = []
+        self.backlog = {}
+
+    def send(self, eio_sid, pkt):
+        self.sent.append((eio_sid, pkt))
+        if self.backlog.get(eio_sid) is not None:
+            self.backlog[eio_sid] += 1
+
+
+def event(name, game_id=None, **data):
+    return ('event', name, dict(data, game_id=game_id))
+
+
+def describe(pkt):
+    kind, name, data = pkt
+    return (name, data) if kind == 'event' else None
+
+
+def outbox(client, **kwargs):
+    return Outbox(client.send, client.backlog.get, describe, **kwargs)
+
+
+def test_parse_limits():
+    limits = parse_limits('create_game=0.5/5, *=10')
+    assert limits == {'create_game': (0.5, 5.0), '*': (10.0, 10.0)}
+    assert parse_limits('off') == {}
+    assert 'card_selected' in parse_limits(DEFAULT_RATE_LIMITS)
+
+
+@pytest.mark.parametrize('spec', ['x=0/5', 'x=1/0.5', 'x=fast'])
+def test_parse_limits_rejects_bad_values(spec):
+    with pytest.raises(ValueError):
+        parse_limits(spec)
+
+
+def test_rate_limiter_refills():
+    clock = Clock()
+    limiter = RateLimiter({'pick': (2.0, 3.0)}, clock=clock)
+    assert [limiter.take('a', 'pick') for _ in range(3)] == [(0.0, False)] * 3
+    assert limiter.take('a', 'pick') == (0.5, True)
+    assert limiter.take('a', 'pick') == (0.5, False)
+    assert limiter.take('b', 'pick') == (0.0, False)
+    clock.now = 0.5
+    assert limiter.take('a', 'pick') == (0.0, False)
+
+
+def test_rate_limiter_default_and_unlimited_events():
+    limiter = RateLimiter({'*': (1.0, 1.0)}, clock=Clock())
+    assert limiter.take('a', 'anything') == (0.0, False)
+    assert limiter.take('a', 'other')[0] == 1.0
+    assert RateLimiter({'pick': (1.0, 1.0)}).take('a', 'other') == \
+        (0.0, False)
+
+
+def test_rate_limiter_prunes_full_buckets():
+    clock = Clock()
+    limiter = RateLimiter({'pick': (1.0, 2.0)}, clock=clock)
+    limiter.take('a', 'pick')
+    limiter.take('b', 'pick')
+    limiter.take('b', 'pick')
+    clock.now = 1.0
+    limiter.prune()
+    assert len(limiter) == 1
+    limiter.forget('b')
+    assert len(limiter) == 0
+
+
+def test_outbox_sends_while_client_keeps_up():
+    client = Client()
+    client.backlog['s'] = 0
+    box = outbox(client, max_backlog=2)
+    box.send('s', event('game_joined', 'g'))
+    box.send('gone', event('game_joined', 'g'))
+    assert [sid for sid, _ in client.sent] == ['s', 'gone']
+    assert len(box) == 0
+
+
+def test_outbox_holds_and_coalesces_once_backlog_is_full():
+    client = Client()
+    client.backlog['s'] = 2
+    box = outbox(client, max_backlog=2)
+    box.send('s', event('card_selected_update', 'g', round=1))
+    box.send('s', event('card_check_result', 'g', round=1))
+    box.send('s', event('card_selected_update', 'g', round=2))
+    box.send('s', event('card_selected_update', 'h', round=1))
+    box.send('s', event('invitation', 'g'))
+    box.send('s', event('invitation', 'g'))
+    assert client.sent == []
+    assert len(box) == 5
+    assert (box.deferred, box.coalesced, box.dropped) == (6, 1, 0)
+
+    client.backlog['s'] = 0
+    box.flush()
+    assert [(pkt[1], pkt[2]['game_id'], pkt[2].get('round'))
+            for _, pkt in client.sent] == [
+        ('card_check_result', 'g', 1),
+        ('card_selected_update', 'g', 2),
+    ]
+    client.backlog['s'] = 0
+    box.flush()
+    client.backlog['s'] = 0
+    box.flush()
+    assert [pkt[1] for _, pkt in client.sent][2:] == [
+        'card_selected_update', 'invitation', 'invitation']
+    assert len(box) == 0
+
+
+def test_outbox_keeps_order_while_holding():
+    client = Client()
+    client.backlog['s'] = 1
+    box = outbox(client, max_backlog=1)
+    box.send('s', event('game_joined', 'g'))
+    client.backlog['s'] = 0
+    # Later events wait behind held ones even though there is room now
+    box.send('s', event('invitation', 'h'))
+    assert client.sent == []
+    box.flush()
+    assert [pkt[1] for _, pkt in client.sent] == ['game_joined']
+
+
+def test_outbox_drops_oldest_when_full():
+    client = Client()
+    client.backlog['s'] = 1
+    box = outbox(client, max_backlog=1, max_held=2)
+    for game_id in 'abc':
+        box.send('s', event('card_selected_update', game_id))
+    assert (len(box), box.dropped) == (2, 1)
+    client.backlog['s'] = 0
+    box.max_backlog = 10
+    box.flush()
+    assert [pkt[2]['game_id'] for _, pkt in client.sent] == ['b', 'c']
+
+
+def test_outbox_never_drops_one_time_events():
+    client = Client()
+    client.backlog['s'] = 1
+    box = outbox(client, max_backlog=1, max_held=2)
+    box.send('s', event('card_selected_update', 'g'))
+    box.send('s', event('game_created', 'h'))
+    box.send('s', event('game_invitation', 'h'))
+    assert (len(box), box.dropped) == (2, 1)
+    client.backlog['s'] = 0
+    box.max_backlog = 10
+    box.flush()
+    assert [pkt[1] for _, pkt in client.sent] == [
+        'game_created', 'game_invitation']
+
+
+def test_outbox_gives_up_on_client_with_only_one_time_events():
+    client = Client()
+    client.backlog['s'] = 1
+    overflowed = []
+    box = outbox(client, max_backlog=1, max_held=2,
+                 on_overflow=overflowed.append)
+    for name in ('game_created', 'game_invitation', 'error'):
+        box.send('s', event(name))
+    assert overflowed == ['s']
+    assert (len(box), box.dropped, box.overflowed) == (0, 0, 1)
+
+
+def test_outbox_passes_other_packets_through():
+    client = Client()
+    client.backlog['s'] = 5
+    box = outbox(client, max_backlog=1)
+    box.send('s', ('ping', None, None))
+    assert client.sent == [('s', ('ping', None, None))]
+    assert box.deferred == 0
+
+
+def test_outbox_forgets_clients_that_left():
+    client = Client()
+    client.backlog.update(s=1, t=1)
+    box = outbox(client, max_backlog=1)
+    box.send('s', event('game_joined', 'g'))
+    box.send('t', event('game_joined', 'g'))
+    box.forget('t')
+    client.backlog['s'] = None
+    box.flush()
+    assert len(box) == 0
+    assert client.sent == []
@@ -0,0 +1,310 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from game_engine import (CARD_COUNT, NO_PICK, RECEIVER, ROUNDS_PER_GAME,
+                         SENDER, GameError, GameState, RoundEngine,
+                         WriteBehind)
+
+
+class RowError(Exception):
+    pass
+
+
+class Database:
+    """Stands in for persist_batch, failing on demand."""
+
+    def __init__(self):
+        self.batches = []
+        self.fail_games = set()
+        self.down = False
+
+    def __call__(self, new_games, updated_games, rounds, results, pairs):
+        if self.down:
+            raise ConnectionError('database unreachable')
+        ids = {row['id'] for row in new_games + updated_games} | \
+            {row['game_id'] for row in rounds + results}
+        if ids & self.fail_games:
+            raise RowError('duplicate key')
+        self.batches.append((new_games, updated_games, rounds, results,
+                             {key: list(totals) for key, totals in
+                              pairs.items()}))
+
+    def rows(self, index):
+        return [row for batch in self.batches for row in batch[index]]
+
+    def pairs(self):
+        totals = {}
+        for batch in self.batches:
+            for key, counts in batch[4].items():
+                merged = totals.setdefault(key, [0, 0, 0])
+                for i, n in enumerate(counts):
+                    merged[i] += n
+        return totals
+
+
+def play(engine, game_id, sender='alice', receiver='bob', rounds=1,
+         cards=(0, 0)):
+    engine.create(game_id, sender)
+    engine.join(game_id, receiver)
+    results = []
+    for _ in range(rounds):
+        engine.pick(game_id, sender, cards[0])
+        results.append(engine.pick(game_id, receiver, cards[1]))
+    return results
+
+
+def test_seat():
+    state = GameState('g', 'alice')
+    assert state.seat('alice') == SENDER
+    assert state.seat('bob') is None
+    assert state.seat(None) is None
+    state.receiver_id = 'bob'
+    assert state.seat('bob') == RECEIVER
+
+
+def test_to_row():
+    row = GameState('g', 'alice', 'bob', 'active').to_row()
+    assert {key: row[key] for key in ('id', 'sender_id', 'receiver_id',
+                                      'status')} == {
+        'id': 'g', 'sender_id': 'alice', 'receiver_id': 'bob',
+        'status': 'active'}
+    assert row['updated_at'] is not None
+
+
+def test_round_resolves_once_both_players_pick():
+    engine = RoundEngine()
+    engine.create('g', 'alice')
+    engine.join('g', 'bob')
+    assert engine.pick('g', 'alice', 3) is None
+    assert engine.pick('g', 'bob', 3) == (1, 3, 3, True)
+    assert engine.pick('g', 'bob', 5) is None
+    assert engine.pick('g', 'alice', 2) == (2, 2, 5, False)
+    state = engine.get('g')
+    assert (state.round, state.score) == (2, 1)
+    assert list(state.history) == [3, 3, 2, 5]
+    assert list(state.picks) == [NO_PICK, NO_PICK]
+
+
+def test_game_finishes_after_last_round():
+    engine = RoundEngine()
+    play(engine, 'g', rounds=ROUNDS_PER_GAME)
+    assert engine.get('g').status == 'finished'
+    with pytest.raises(GameError, match='Game is finished'):
+        engine.pick('g', 'alice', 0)
+
+
+def test_join_rules():
+    engine = RoundEngine()
+    engine.create('g', 'alice')
+    assert engine.join('g', 'alice').receiver_id is None
+    engine.join('g', 'bob')
+    assert engine.join('g', 'bob').status == 'active'
+    with pytest.raises(GameError, match='Game is full'):
+        engine.join('g', 'eve')
+    with pytest.raises(GameError, match='Game not found'):
+        engine.join('missing', 'bob')
+
+
+@pytest.mark.parametrize('user_id, card, message', [
+    ('eve', 0, 'Not a player in this game'),
+    ('alice', CARD_COUNT, 'Invalid card'),
+    ('alice', -1, 'Invalid card'),
+])
+def test_invalid_picks(user_id, card, message):
+    engine = RoundEngine()
+    engine.create('g', 'alice')
+    engine.join('g', 'bob')
+    with pytest.raises(GameError, match=message):
+        engine.pick('g', user_id, card)
+
+
+def test_create_refuses_a_live_id():
+    engine = RoundEngine()
+    engine.create('g', 'alice')
+    engine.join('g', 'bob')
+    with pytest.raises(GameError, match='already exists'):
+        engine.create('g', 'carol')
+    assert engine.get('g').sender_id == 'alice'
+
+
+def test_pick_twice_in_a_round():
+    engine = RoundEngine()
+    engine.create('g', 'alice')
+    engine.join('g', 'bob')
+    engine.pick('g', 'alice', 1)
+    with pytest.raises(GameError, match='already selected'):
+        engine.pick('g', 'alice', 2)
+
+
+def test_pick_before_join():
+    engine = RoundEngine()
+    engine.create('g', 'alice')
+    with pytest.raises(GameError, match='Game is pending'):
+        engine.pick('g', 'alice', 0)
+
+
+def test_adopt_replays_rounds():
+    engine = RoundEngine()
+    state = engine.adopt('g', 'alice', 'bob', 'active', [(1, 1), (2, 3)])
+    assert (state.round, state.score, state.persisted) == (2, 1, True)
+    assert engine.pick('g', 'alice', 4) is None
+    assert engine.pick('g', 'bob', 4) == (3, 4, 4, True)
+
+
+def test_adopt_keeps_a_game_already_loaded():
+    write_behind = WriteBehind(Database())
+    engine = RoundEngine(write_behind)
+    first = engine.adopt('g', 'alice', None, 'pending')
+    engine.join('g', 'bob')
+    # A second event for the game finished its own database load later
+    second = engine.adopt('g', 'alice', None, 'pending')
+    assert second is first
+    assert (second.receiver_id, second.status) == ('bob', 'active')
+    assert write_behind._games['g'] is engine.get('g')
+
+
+def test_expire_buries_idle_games():
+    engine = RoundEngine(WriteBehind(Database()))
+    engine.create('pending', 'alice')
+    play(engine, 'finished', rounds=ROUNDS_PER_GAME)
+    engine.create('fresh', 'carol')
+    engine.get('pending').updated_at -= 100
+    engine.get('finished').updated_at -= 100
+    removed = engine.expire(engine.get('fresh').updated_at,
+                            {'pending': 50, 'finished': 50})
+    assert sorted(removed) == ['finished', 'pending']
+    assert list(engine.games) == ['fresh']
+    assert engine.ended('pending') == 'expired'
+    assert engine.ended('finished') == 'finished'
+    with pytest.raises(GameError, match='Game is expired'):
+        engine.join('pending', 'bob')
+
+
+def test_tombstones_are_bounded():
+    engine = RoundEngine(max_tombstones=2)
+    for game_id in ('a', 'b', 'c'):
+        engine.bury(game_id, 'expired')
+    assert engine.ended('a') is None
+    assert engine.ended('c') == 'expired'
+
+
+def test_write_behind_batches_games_rounds_and_totals():
+    database = Database()
+    engine = RoundEngine(WriteBehind(database))
+    play(engine, 'g', rounds=ROUNDS_PER_GAME, cards=(2, 2))
+    assert engine.write_behind.flush() == 1 + ROUNDS_PER_GAME + 2
+    new_games, updated_games, rounds, results, pairs = database.batches[0]
+    assert [row['status'] for row in new_games] == ['finished']
+    assert updated_games == []
+    assert [row['round_number'] for row in rounds] == \
+        list(range(1, ROUNDS_PER_GAME + 1))
+    assert sorted(row['role'] for row in results) == ['receiver', 'sender']
+    assert pairs == {('alice', 'bob'): [1, ROUNDS_PER_GAME, ROUNDS_PER_GAME]}
+    assert engine.get('g').persisted
+    assert engine.write_behind.flush() == 0
+
+
+def test_write_behind_updates_persisted_games():
+    database = Database()
+    engine = RoundEngine(WriteBehind(database))
+    engine.create('g', 'alice')
+    engine.write_behind.flush()
+    engine.join('g', 'bob')
+    engine.write_behind.flush()
+    assert [row['status'] for row in database.batches[1][1]] == ['active']
+
+
+def test_write_behind_retries_and_merges_after_failure():
+    database = Database()
+    write_behind = WriteBehind(database, max_retries=3,
+                               is_row_error=lambda e: isinstance(e, RowError))
+    engine = RoundEngine(write_behind)
+    play(engine, 'g', cards=(1, 1))
+    database.down = True
+    for _ in range(5):
+        with pytest.raises(ConnectionError):
+            write_behind.flush()
+    # Queued while the database was down, merged with the failed batch
+    engine.pick('g', 'alice', 1)
+    engine.pick('g', 'bob', 2)
+    database.down = False
+    assert write_behind.flush() == 1 + 2
+    assert [row['round_number'] for row in database.rows(2)] == [1, 2]
+    assert database.pairs() == {('alice', 'bob'): [0, 2, 1]}
+    assert write_behind.dropped == 0
+
+
+def test_write_behind_drops_a_game_that_keeps_failing():
+    database = Database()
+    dropped = []
+    write_behind = WriteBehind(
+        database, max_retries=2,
+        is_row_error=lambda e: isinstance(e, RowError),
+        on_drop=lambda game_id, rows, e: dropped.append((game_id, len(rows))))
+    engine = RoundEngine(write_behind)
+    play(engine, 'bad', rounds=2, cards=(0, 0))
+    play(engine, 'good', sender='carol', receiver='dave',
+         rounds=ROUNDS_PER_GAME, cards=(0, 1))
+    database.fail_games.add('bad')
+
+    with pytest.raises(RowError):
+        write_behind.flush()
+    # The second failure in a row splits the queue by game
+    assert write_behind.flush() == 1 + ROUNDS_PER_GAME + 2
+    assert dropped == [('bad', 1 + 2)]
+    assert write_behind.dropped == 1
+    assert len(write_behind) == 0
+    assert {row['id'] for row in database.rows(0)} == {'good'}
+    assert database.pairs() == {('carol', 'dave'): [1, ROUNDS_PER_GAME, 0]}
+
+    # Later games are written normally again
+    play(engine, 'next', rounds=1)
+    assert write_behind.flush() == 2
+
+
+def test_write_behind_keeps_rows_when_the_database_fails_while_splitting():
+    database = Database()
+    write_behind = WriteBehind(database, max_retries=1,
+                               is_row_error=lambda e: isinstance(e, RowError))
+    engine = RoundEngine(write_behind)
+    play(engine, 'good', rounds=1)
+    play(engine, 'bad', sender='carol', receiver='dave', rounds=1)
+    database.fail_games.add('bad')
+    write = database.__call__
+
+    def write_then_go_down(*batch):
+        write(*batch)
+        database.down = True
+
+    # The whole batch hits a row error, the first game on its own is
+    # written, then the database goes away before the second one
+    write_behind._flush = write_then_go_down
+    with pytest.raises(ConnectionError):
+        write_behind.flush()
+    assert {row['id'] for row in database.rows(0)} == {'good'}
+    assert len(write_behind) == 2
+    assert write_behind.dropped == 0
+
+    database.down = False
+    database.fail_games.clear()
+    write_behind._flush = database
+    assert write_behind.flush() == 2
+    assert database.pairs() == {('alice', 'bob'): [0, 1, 1],
+                                ('carol', 'dave'): [0, 1, 1]}
+
+
+def test_first_pick_marks_game_for_reaper():
+    database = Database()
+    write_behind = WriteBehind(database)
+    engine = RoundEngine(write_behind)
+    play(engine, 'g', rounds=1)
+    write_behind.flush()
+    engine.get('g').updated_at -= 100
+    assert engine.pick('g', 'alice', 2) is None
+    write_behind.flush()
+    _, updated_games, rounds, _, _ = database.batches[-1]
+    assert rounds == []
+    assert updated_games == [engine.get('g').to_row()]
+    assert updated_games[0]['updated_at'] > datetime.utcnow() - timedelta(
+        seconds=50)
@@ -0,0 +1,96 @@
+import pytest
+
+import presence
+from presence import Inbox, Presence, normalize_email
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(presence, 'time', clock)
+    return clock
+
+
+def invitation(game_id):
+    return {'game_id': game_id, 'sender_email': 'alice@example.com'}
+
+
+def test_normalize_email():
+    assert normalize_email('  Bob@Example.COM ') == 'bob@example.com'
+
+
+def test_presence_indexes_sids_by_user_and_email():
+    users = Presence()
+    users.add('s1', 'bob', 'Bob@example.com')
+    users.add('s2', 'bob', 'bob@example.com')
+    assert set(users.sids_for_user('bob')) == {'s1', 's2'}
+    assert set(users.sids_for_email('BOB@example.com ')) == {'s1', 's2'}
+    users.set_game('s1', 'g')
+    assert users.user('s1')['game_id'] == 'g'
+
+    assert users.remove('s1')['user_id'] == 'bob'
+    assert users.remove('s1') is None
+    users.remove('s2')
+    assert (len(users), users.sids_for_user('bob'),
+            users.sids_for_email('bob@example.com')) == (0, (), ())
+
+
+def test_inbox_delivers_until_ttl(clock):
+    inbox = Inbox(ttl=60)
+    inbox.hold('Bob@example.com', invitation('g1'))
+    clock.now += 30
+    inbox.hold('bob@example.com', invitation('g2'))
+    clock.now += 30
+    assert inbox.drain('BOB@example.com') == [invitation('g2')]
+    assert inbox.drain('bob@example.com') == []
+
+
+def test_inbox_expire_drops_old_invitations_and_empty_boxes(clock):
+    inbox = Inbox(ttl=60)
+    inbox.hold('bob@example.com', invitation('g1'))
+    inbox.hold('carol@example.com', invitation('g2'))
+    clock.now += 30
+    inbox.hold('bob@example.com', invitation('g3'))
+    clock.now += 30
+    inbox.expire()
+    assert len(inbox) == 1
+    assert inbox.drain('bob@example.com') == [invitation('g3')]
+
+
+def test_inbox_keeps_newest_per_user(clock):
+    inbox = Inbox(per_user=2)
+    for game_id in ('g1', 'g2', 'g3'):
+        inbox.hold('bob@example.com', invitation(game_id))
+    assert inbox.drain('bob@example.com') == [invitation('g2'),
+                                              invitation('g3')]
+
+
+def test_inbox_evicts_least_recently_used_user(clock):
+    inbox = Inbox(max_users=2)
+    inbox.hold('a@example.com', invitation('g1'))
+    inbox.hold('b@example.com', invitation('g2'))
+    inbox.hold('a@example.com', invitation('g3'))
+    inbox.hold('c@example.com', invitation('g4'))
+    assert len(inbox) == 2
+    assert inbox.drain('b@example.com') == []
+    assert len(inbox.drain('a@example.com')) == 2
+
+
+def test_inbox_discard(clock):
+    inbox = Inbox()
+    inbox.hold('bob@example.com', invitation('g1'))
+    inbox.hold('bob@example.com', invitation('g2'))
+    inbox.discard('Bob@example.com', 'g1')
+    inbox.discard('nobody@example.com', 'g1')
+    assert inbox.drain('bob@example.com') == [invitation('g2')]
+    inbox.hold('bob@example.com', invitation('g1'))
+    inbox.discard('bob@example.com', 'g1')
+    assert len(inbox) == 0
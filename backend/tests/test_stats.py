@@ -0,0 +1,107 @@
+import math
+import random
+from fractions import Fraction
+
+import pytest
+
+import stats
+from game_engine import CARD_COUNT
+from stats import (CHANCE, EXACT_TAIL_LIMIT, _totals_python, pair_key,
+                   p_value, recompute_totals, summary, user_totals, z_score)
+
+
+def exact_tail(hits, rounds):
+    # In integers: each card matches with probability 1 / CARD_COUNT
+    misses = CARD_COUNT - 1
+    ways = sum(math.comb(rounds, k) * misses ** (rounds - k)
+               for k in range(hits, rounds + 1))
+    return float(Fraction(ways, CARD_COUNT ** rounds))
+
+
+def test_pair_key_is_sorted():
+    assert pair_key('bob', 'alice') == pair_key('alice', 'bob') == \
+        ('alice', 'bob')
+
+
+def test_z_score():
+    assert z_score(0, 0) == 0.0
+    assert z_score(10, 80) == 0.0
+    assert z_score(20, 80) == pytest.approx(
+        10 / math.sqrt(80 * CHANCE * (1 - CHANCE)))
+    assert z_score(0, 80) < 0
+
+
+@pytest.mark.parametrize('hits, rounds', [
+    (1, 1), (1, 10), (2, 10), (5, 10), (10, 10), (3, 80), (10, 80),
+    (25, 80), (60, 500), (130, 1000),
+])
+def test_p_value_matches_exact_binomial_tail(hits, rounds):
+    assert p_value(hits, rounds) == pytest.approx(exact_tail(hits, rounds),
+                                                  rel=1e-9, abs=1e-15)
+
+
+def test_p_value_edges():
+    assert p_value(0, 0) == 1.0
+    assert p_value(0, 50) == 1.0
+    assert p_value(-1, 50) == 1.0
+    assert 0.0 <= p_value(1, 50) <= 1.0
+
+
+def test_p_value_uses_normal_approximation_for_long_histories():
+    rounds = EXACT_TAIL_LIMIT * 2
+    # The binomial is skewed, so the approximation is only checked to within
+    # half a percent
+    for hits in (225, 250, 280, 300):
+        assert p_value(hits, rounds) == pytest.approx(
+            exact_tail(hits, rounds), abs=5e-3)
+
+
+def test_summary():
+    assert summary() == {'games': 0, 'rounds': 0, 'hits': 0,
+                         'hit_rate': None, 'chance': CHANCE, 'z_score': 0.0,
+                         'p_value': 1.0}
+    row = summary(2, 20, 5)
+    assert row['hit_rate'] == 0.25
+    assert row['z_score'] == round(z_score(5, 20), 3)
+
+
+def test_user_totals_counts_each_pair_for_both_players():
+    pairs = {('alice', 'bob'): (1, 10, 2), ('alice', 'carol'): (2, 20, 3)}
+    assert user_totals(pairs) == {'alice': (3, 30, 5), 'bob': (1, 10, 2),
+                                  'carol': (2, 20, 3)}
+
+
+def test_recompute_totals():
+    pairs, per_user = recompute_totals(['bob', 'alice', 'alice'],
+                                       ['alice', 'bob', 'carol'],
+                                       [1, 0, 1], [10, 4, 10], [2, 1, 3])
+    assert pairs == {('alice', 'bob'): (1, 14, 3),
+                     ('alice', 'carol'): (1, 10, 3)}
+    assert per_user == {'alice': (2, 24, 6), 'bob': (1, 14, 3),
+                        'carol': (1, 10, 3)}
+    assert recompute_totals([], [], [], [], []) == ({}, {})
+
+
+def test_recompute_totals_matches_pure_python():
+    if stats.np is None:
+        pytest.skip('NumPy is not installed')
+    rng = random.Random(7)
+    users = ['user%d' % i for i in range(40)] + ['Zed', 'émile', '10', '9']
+    games = 2000
+    senders, receivers = [], []
+    for _ in range(games):
+        sender, receiver = rng.sample(users, 2)
+        senders.append(sender)
+        receivers.append(receiver)
+    finished = [rng.random() < 0.8 for _ in range(games)]
+    rounds = [rng.randint(0, 10) for _ in range(games)]
+    hits = [rng.randint(0, n) for n in rounds]
+    assert recompute_totals(senders, receivers, finished, rounds, hits) == \
+        _totals_python(senders, receivers, finished, rounds, hits)
+
+
+def test_recompute_totals_without_numpy(monkeypatch):
+    monkeypatch.setattr(stats, 'np', None)
+    pairs, per_user = recompute_totals(['bob'], ['alice'], [1], [10], [2])
+    assert pairs == {('alice', 'bob'): (1, 10, 2)}
+    assert per_user == {'alice': (1, 10, 2), 'bob': (1, 10, 2)}
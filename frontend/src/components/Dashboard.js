@@ -1,16 +1,37 @@
-import React, { useState } from 'react';
+import React, { useState, useEffect } from 'react';
 import { Container, Button, TextField, Typography, Box, Paper } from '@mui/material';
 import { useNavigate } from 'react-router-dom';
 import { socket } from '../socket';
 
 const Dashboard = () => {
   const [inviteEmail, setInviteEmail] = useState('');
+  const [invitations, setInvitations] = useState([]);
   const navigate = useNavigate();
   const user = JSON.parse(localStorage.getItem('user'));
 
+  useEffect(() => {
+    // Invitations arrive one at a time while online, or as a batch of the
+    // ones held for us while we were offline
+    const addInvitations = (incoming) => {
+      setInvitations(prev => [
+        ...prev,
+        ...incoming.filter(inv => !prev.some(p => p.game_id === inv.game_id))
+      ]);
+    };
+    const onInvitation = (data) => addInvitations([data]);
+
+    socket.on('game_invitation', onInvitation);
+    socket.on('game_invitations', addInvitations);
+
+    return () => {
+      socket.off('game_invitation', onInvitation);
+      socket.off('game_invitations', addInvitations);
+    };
+  }, []);
+
   const handleCreateGame = () => {
     socket.emit('create_game', { sender_id: user.user_id });
-    socket.on('game_created', (data) => {
+    socket.once('game_created', (data) => {
       handleInvitePlayer(data.game_id);
     });
   };
@@ -53,6 +74,29 @@ const Dashboard = () => {
             </Button>
           </Box>
         </Paper>
+
+        {invitations.length > 0 && (
+          <Paper elevation={3} sx={{ p: 3, mt: 3 }}>
+            <Typography variant="h6" gutterBottom>
+              Invitations
+            </Typography>
+            {invitations.map((invitation) => (
+              <Box
+                key={invitation.game_id}
+                sx={{ display: 'flex', alignItems: 'center', justifyContent: 'space-between', mt: 2 }}
+              >
+                <Typography>{invitation.sender_email} invited you to play</Typography>
+                <Button
+                  variant="outlined"
+                  color="primary"
+                  onClick={() => navigate(`/game/${invitation.game_id}`)}
+                >
+                  Join
+                </Button>
+              </Box>
+            ))}
+          </Paper>
+        )}
       </Box>
     </Container>
   );
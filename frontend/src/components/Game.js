@@ -24,7 +24,9 @@ const Game = () => {
     socket.on('game_joined', (data) => {
       setGameState(prev => ({
         ...prev,
-        isFirstPlayer: data.first_player_id === user.user_id
+        isFirstPlayer: data.first_player_id === user.user_id,
+        currentRound: data.round,
+        score: data.score
       }));
     });
 
@@ -38,18 +40,15 @@ const Game = () => {
     });
 
     socket.on('card_check_result', (data) => {
-      const isCorrect = data.is_correct;
-      if (isCorrect) {
-        setGameState(prev => ({
-          ...prev,
-          score: prev.score + 1
-        }));
-      }
+      setGameState(prev => ({
+        ...prev,
+        score: data.score
+      }));
       // Move to next round
       setTimeout(() => {
         setGameState(prev => ({
           ...prev,
-          currentRound: prev.currentRound + 1,
+          currentRound: data.round,
           waitingForSecondPlayer: false
         }));
         setSelectedCard(null);
@@ -70,23 +69,15 @@ const Game = () => {
     }
 
     setSelectedCard(index);
-    socket.emit('card_selected', {
-      game_id: gameId,
-      card_index: index,
-      user_id: user.user_id
-    });
+    // The server knows which game this connection joined, so a pick is just
+    // the card index.
+    socket.emit('card_selected', index);
 
     if (gameState.isFirstPlayer) {
       setGameState(prev => ({
         ...prev,
         waitingForSecondPlayer: true
       }));
-    } else {
-      socket.emit('check_card', {
-        game_id: gameId,
-        card_index: index,
-        is_correct: index === selectedCard
-      });
     }
   };
 
@@ -1,6 +1,7 @@
 import React, { useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { Button, Container, Typography, Box } from '@mui/material';
+import { socket } from '../socket';
 
 const Login = () => {
   const navigate = useNavigate();
@@ -85,6 +86,7 @@ const Login = () => {
 
       if (data.user_id) {
         localStorage.setItem('user', JSON.stringify(data));
+        socket.disconnect().connect();
         navigate('/dashboard');
       }
     } catch (error) {
@@ -0,0 +1,274 @@
+// Socket.IO parser that sends every packet as one MessagePack frame, matching
+// the backend's SOCKETIO_SERIALIZER=msgpack (python-socketio's MsgPackPacket).
+// A packet is encoded as the map {type, nsp, data, id}. The codec covers
+// the MessagePack types the two sides exchange: nil, booleans, numbers,
+// strings, binary, arrays and maps.
+
+const textEncoder = new TextEncoder();
+const textDecoder = new TextDecoder();
+
+const PACKET_TYPES = 7;  // CONNECT .. BINARY_ACK
+
+class Writer {
+  constructor() {
+    this.bytes = new Uint8Array(64);
+    this.view = new DataView(this.bytes.buffer);
+    this.length = 0;
+  }
+
+  reserve(n) {
+    if (this.length + n <= this.bytes.length) return;
+    let size = this.bytes.length * 2;
+    while (size < this.length + n) size *= 2;
+    const bytes = new Uint8Array(size);
+    bytes.set(this.bytes.subarray(0, this.length));
+    this.bytes = bytes;
+    this.view = new DataView(bytes.buffer);
+  }
+
+  byte(b) {
+    this.reserve(1);
+    this.bytes[this.length++] = b;
+  }
+
+  // Writes a type byte followed by a big-endian length or value; negative
+  // values only reach the 8-byte form, the shorter ones get two's complement
+  head(type, size, n) {
+    this.reserve(1 + size);
+    this.bytes[this.length++] = type;
+    if (size === 1) this.view.setUint8(this.length, n);
+    else if (size === 2) this.view.setUint16(this.length, n);
+    else if (size === 4) this.view.setUint32(this.length, n);
+    else this.view.setBigInt64(this.length, BigInt(n));
+    this.length += size;
+  }
+
+  raw(bytes) {
+    this.reserve(bytes.length);
+    this.bytes.set(bytes, this.length);
+    this.length += bytes.length;
+  }
+
+  result() {
+    return this.bytes.slice(0, this.length);
+  }
+}
+
+function encodeLength(writer, n, fix, fixMax, type8, type16, type32) {
+  if (n <= fixMax) writer.byte(fix | n);
+  else if (type8 !== null && n < 0x100) writer.head(type8, 1, n);
+  else if (n < 0x10000) writer.head(type16, 2, n);
+  else writer.head(type32, 4, n);
+}
+
+function encodeNumber(writer, n) {
+  if (!Number.isSafeInteger(n)) {
+    writer.reserve(9);
+    writer.bytes[writer.length++] = 0xcb;
+    writer.view.setFloat64(writer.length, n);
+    writer.length += 8;
+  } else if (n >= 0) {
+    if (n < 0x80) writer.byte(n);
+    else if (n < 0x100) writer.head(0xcc, 1, n);
+    else if (n < 0x10000) writer.head(0xcd, 2, n);
+    else if (n < 0x100000000) writer.head(0xce, 4, n);
+    else writer.head(0xcf, 8, n);
+  } else if (n >= -0x20) {
+    writer.byte(n & 0xff);
+  } else if (n >= -0x80) {
+    writer.head(0xd0, 1, n & 0xff);
+  } else if (n >= -0x8000) {
+    writer.head(0xd1, 2, n & 0xffff);
+  } else if (n >= -0x80000000) {
+    writer.head(0xd2, 4, n >>> 0);
+  } else {
+    writer.head(0xd3, 8, n);
+  }
+}
+
+function encodeValue(writer, value) {
+  if (value === null || value === undefined) {
+    writer.byte(0xc0);
+  } else if (value === false || value === true) {
+    writer.byte(value ? 0xc3 : 0xc2);
+  } else if (typeof value === 'number') {
+    encodeNumber(writer, value);
+  } else if (typeof value === 'string') {
+    const bytes = textEncoder.encode(value);
+    encodeLength(writer, bytes.length, 0xa0, 31, 0xd9, 0xda, 0xdb);
+    writer.raw(bytes);
+  } else if (value instanceof ArrayBuffer || ArrayBuffer.isView(value)) {
+    const bytes = value instanceof ArrayBuffer ? new Uint8Array(value)
+      : new Uint8Array(value.buffer, value.byteOffset, value.byteLength);
+    encodeLength(writer, bytes.length, 0, -1, 0xc4, 0xc5, 0xc6);
+    writer.raw(bytes);
+  } else if (Array.isArray(value)) {
+    encodeLength(writer, value.length, 0x90, 15, null, 0xdc, 0xdd);
+    value.forEach((item) => encodeValue(writer, item));
+  } else if (typeof value.toJSON === 'function') {
+    encodeValue(writer, value.toJSON());
+  } else {
+    // Like JSON, keys whose value is undefined are left out
+    const keys = Object.keys(value).filter((key) => value[key] !== undefined);
+    encodeLength(writer, keys.length, 0x80, 15, null, 0xde, 0xdf);
+    keys.forEach((key) => {
+      encodeValue(writer, key);
+      encodeValue(writer, value[key]);
+    });
+  }
+}
+
+export function encode(value) {
+  const writer = new Writer();
+  encodeValue(writer, value);
+  return writer.result();
+}
+
+class Reader {
+  constructor(data) {
+    this.bytes = data instanceof Uint8Array ? data
+      : ArrayBuffer.isView(data)
+        ? new Uint8Array(data.buffer, data.byteOffset, data.byteLength)
+        : new Uint8Array(data);
+    this.view = new DataView(this.bytes.buffer, this.bytes.byteOffset,
+      this.bytes.byteLength);
+    this.offset = 0;
+  }
+
+  take(n) {
+    if (this.offset + n > this.bytes.length) {
+      throw new Error('Truncated MessagePack data');
+    }
+    const start = this.offset;
+    this.offset += n;
+    return start;
+  }
+
+  uint(size) {
+    const at = this.take(size);
+    if (size === 1) return this.view.getUint8(at);
+    if (size === 2) return this.view.getUint16(at);
+    if (size === 4) return this.view.getUint32(at);
+    return Number(this.view.getBigUint64(at));
+  }
+
+  int(size) {
+    const at = this.take(size);
+    if (size === 1) return this.view.getInt8(at);
+    if (size === 2) return this.view.getInt16(at);
+    if (size === 4) return this.view.getInt32(at);
+    return Number(this.view.getBigInt64(at));
+  }
+
+  str(n) {
+    const at = this.take(n);
+    return textDecoder.decode(this.bytes.subarray(at, at + n));
+  }
+
+  bin(n) {
+    const at = this.bytes.byteOffset + this.take(n);
+    return this.bytes.buffer.slice(at, at + n);
+  }
+
+  array(n) {
+    const items = new Array(n);
+    for (let i = 0; i < n; i++) items[i] = this.value();
+    return items;
+  }
+
+  map(n) {
+    const map = {};
+    for (let i = 0; i < n; i++) {
+      const key = this.value();
+      map[key] = this.value();
+    }
+    return map;
+  }
+
+  value() {
+    const type = this.bytes[this.take(1)];
+    if (type < 0x80) return type;
+    if (type < 0x90) return this.map(type & 0x0f);
+    if (type < 0xa0) return this.array(type & 0x0f);
+    if (type < 0xc0) return this.str(type & 0x1f);
+    if (type >= 0xe0) return type - 0x100;
+    switch (type) {
+      case 0xc0: return null;
+      case 0xc2: return false;
+      case 0xc3: return true;
+      case 0xc4: return this.bin(this.uint(1));
+      case 0xc5: return this.bin(this.uint(2));
+      case 0xc6: return this.bin(this.uint(4));
+      case 0xca: return this.view.getFloat32(this.take(4));
+      case 0xcb: return this.view.getFloat64(this.take(8));
+      case 0xcc: return this.uint(1);
+      case 0xcd: return this.uint(2);
+      case 0xce: return this.uint(4);
+      case 0xcf: return this.uint(8);
+      case 0xd0: return this.int(1);
+      case 0xd1: return this.int(2);
+      case 0xd2: return this.int(4);
+      case 0xd3: return this.int(8);
+      case 0xd9: return this.str(this.uint(1));
+      case 0xda: return this.str(this.uint(2));
+      case 0xdb: return this.str(this.uint(4));
+      case 0xdc: return this.array(this.uint(2));
+      case 0xdd: return this.array(this.uint(4));
+      case 0xde: return this.map(this.uint(2));
+      case 0xdf: return this.map(this.uint(4));
+      default:
+        throw new Error(`Unsupported MessagePack type 0x${type.toString(16)}`);
+    }
+  }
+}
+
+export function decode(data) {
+  const reader = new Reader(data);
+  const value = reader.value();
+  if (reader.offset !== reader.bytes.length) {
+    throw new Error('Trailing bytes after MessagePack value');
+  }
+  return value;
+}
+
+export const protocol = 5;
+
+export class Encoder {
+  encode(packet) {
+    return [encode(packet)];
+  }
+}
+
+export class Decoder {
+  constructor() {
+    this.listeners = {};
+  }
+
+  on(event, listener) {
+    (this.listeners[event] = this.listeners[event] || []).push(listener);
+    return this;
+  }
+
+  add(data) {
+    const packet = decode(data);
+    if (!isPacket(packet)) {
+      throw new Error(`Invalid packet: ${JSON.stringify(packet)}`);
+    }
+    (this.listeners.decoded || []).forEach((listener) => listener(packet));
+  }
+
+  destroy() {
+    this.listeners = {};
+  }
+}
+
+function isPacket(packet) {
+  return packet !== null && typeof packet === 'object' &&
+    Number.isInteger(packet.type) && packet.type >= 0 &&
+    packet.type < PACKET_TYPES && typeof packet.nsp === 'string' &&
+    (packet.id === undefined || packet.id === null ||
+      Number.isInteger(packet.id));
+}
+
+const msgpackParser = { protocol, Encoder, Decoder };
+export default msgpackParser;
@@ -0,0 +1,132 @@
+/**
+ * @jest-environment node
+ */
+import msgpackParser, { decode, encode } from './msgpackParser';
+
+// Expected bytes come from Python's msgpack.packb, which the backend's
+// python-socketio MsgPackPacket uses, so both sides agree byte for byte.
+const VALUES = [
+  [null, 'c0'],
+  [true, 'c3'],
+  [false, 'c2'],
+  [0, '00'],
+  [127, '7f'],
+  [128, 'cc80'],
+  [255, 'ccff'],
+  [256, 'cd0100'],
+  [65535, 'cdffff'],
+  [65536, 'ce00010000'],
+  [2 ** 32 - 1, 'ceffffffff'],
+  [2 ** 32, 'cf0000000100000000'],
+  [-1, 'ff'],
+  [-32, 'e0'],
+  [-33, 'd0df'],
+  [-128, 'd080'],
+  [-129, 'd1ff7f'],
+  [-32768, 'd18000'],
+  [-32769, 'd2ffff7fff'],
+  [-(2 ** 31), 'd280000000'],
+  [-(2 ** 31) - 1, 'd3ffffffff7fffffff'],
+  [1.5, 'cb3ff8000000000000'],
+  [-0.25, 'cbbfd0000000000000'],
+  ['', 'a0'],
+  ['a', 'a161'],
+  ['é€😀', 'a9c3a9e282acf09f9880'],
+  [[1, [2, null]], '92019202c0'],
+  [{ game_id: 'g', round: 3 }, '82a767616d655f6964a167a5726f756e6403'],
+];
+
+// Header bytes Python writes for values past each size class
+const HEADERS = [
+  ['x'.repeat(31), 'bf'],
+  ['x'.repeat(32), 'd920'],
+  ['x'.repeat(256), 'da0100'],
+  ['x'.repeat(65536), 'db00010000'],
+  [Array.from({ length: 16 }, (_, i) => i), 'dc0010'],
+  [Array.from({ length: 70000 }, (_, i) => i), 'dd00011170'],
+  [Object.fromEntries(Array.from({ length: 16 }, (_, i) => [`${i}`, i])),
+    'de0010'],
+];
+
+// Packets as python-socketio's MsgPackPacket encodes them
+const PACKETS = [
+  [{ type: 2, data: ['card_check_result', { game_id: 'g', round: 3, is_correct: true }], nsp: '/' },
+    '83a47479706502a46461746192b1636172645f636865636b5f726573756c7483a767616d655f6964a167a5726f756e6403aa69735f636f7272656374c3a36e7370a12f'],
+  [{ type: 0, data: { sid: 'abc' }, nsp: '/' },
+    '83a47479706500a46461746181a3736964a3616263a36e7370a12f'],
+  [{ type: 4, data: { message: 'Authentication required' }, nsp: '/' },
+    '83a47479706504a46461746181a76d657373616765b741757468656e7469636174696f6e207265717569726564a36e7370a12f'],
+  [{ type: 2, data: ['card_selected', 3], nsp: '/', id: 7 },
+    '84a47479706502a46461746192ad636172645f73656c656374656403a36e7370a12fa2696407'],
+];
+
+const toHex = (bytes) =>
+  Array.from(bytes, (b) => b.toString(16).padStart(2, '0')).join('');
+
+const fromHex = (hex) =>
+  new Uint8Array(hex.match(/../g).map((byte) => parseInt(byte, 16)));
+
+const decodeAll = (frames) => {
+  const decoder = new msgpackParser.Decoder();
+  const packets = [];
+  decoder.on('decoded', (packet) => packets.push(packet));
+  frames.forEach((frame) => decoder.add(frame));
+  return packets;
+};
+
+describe('MessagePack codec', () => {
+  test.each(VALUES)('%j matches msgpack', (value, hex) => {
+    expect(toHex(encode(value))).toBe(hex);
+    expect(decode(fromHex(hex))).toEqual(value);
+  });
+
+  test.each(HEADERS)('long values use the wider header %#', (value, header) => {
+    const bytes = encode(value);
+    expect(toHex(bytes.subarray(0, header.length / 2))).toBe(header);
+    expect(decode(bytes)).toEqual(value);
+  });
+
+  test('binary decodes to an ArrayBuffer holding just its bytes', () => {
+    const frame = fromHex('ffc4030001ff').subarray(1);
+    const value = decode(frame);
+    expect(value).toBeInstanceOf(ArrayBuffer);
+    expect(Array.from(new Uint8Array(value))).toEqual([0, 1, 255]);
+    expect(toHex(encode(new Uint8Array([0, 1, 255])))).toBe('c4030001ff');
+  });
+
+  test('undefined map values are left out, like JSON', () => {
+    expect(decode(encode({ a: 1, b: undefined }))).toEqual({ a: 1 });
+  });
+
+  test('rejects truncated data and trailing bytes', () => {
+    expect(() => decode(fromHex('a3616263').subarray(0, 3))).toThrow('Truncated');
+    expect(() => decode(fromHex('c0c0'))).toThrow('Trailing');
+    expect(() => decode(fromHex('c1'))).toThrow('Unsupported');
+  });
+});
+
+describe('Socket.IO parser', () => {
+  test('speaks protocol 5', () => {
+    expect(msgpackParser.protocol).toBe(5);
+  });
+
+  test.each(PACKETS)('encodes %j like MsgPackPacket', (packet, hex) => {
+    const frames = new msgpackParser.Encoder().encode(packet);
+    expect(frames.map(toHex)).toEqual([hex]);
+  });
+
+  test('decodes MsgPackPacket frames', () => {
+    expect(decodeAll(PACKETS.map(([, hex]) => fromHex(hex))))
+      .toEqual(PACKETS.map(([packet]) => packet));
+  });
+
+  test.each([
+    [{ x: 1 }],
+    [{ type: 7, nsp: '/' }],
+    [{ type: 2, nsp: 5 }],
+    [{ type: 2, nsp: '/', id: 'x' }],
+    ['not a packet'],
+  ])('refuses %j', (value) => {
+    expect(() => decodeAll([encode(value)])).toThrow('Invalid packet');
+  });
+});
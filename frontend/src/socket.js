@@ -1,13 +1,21 @@
 import { io } from 'socket.io-client';
+import msgpackParser from './msgpackParser';
 
 const BACKEND_URL = process.env.REACT_APP_API_URL || 'https://telepathy-test.onrender.com';
 
 console.log('Connecting to backend at:', BACKEND_URL);
 
+const sessionToken = () => {
+  const user = JSON.parse(localStorage.getItem('user'));
+  return user ? user.session_token : null;
+};
+
 export const socket = io(BACKEND_URL, {
-  autoConnect: true,
-  transports: ['polling'],
-  upgrade: false,
+  autoConnect: false,
+  // WebSocket first, with MessagePack frames to match the backend's
+  // SOCKETIO_SERIALIZER; see connect_error below for the polling fallback.
+  transports: ['websocket', 'polling'],
+  parser: msgpackParser,
   path: '/socket.io',
   reconnection: true,
   reconnectionAttempts: 10,
@@ -17,17 +25,30 @@ export const socket = io(BACKEND_URL, {
   timeout: 60000,
   withCredentials: false,
   forceNew: true,
-  auth: {
-    token: 'anonymous'
-  }
+  auth: (cb) => cb({ token: sessionToken() })
 });
 
+// Sockets are authenticated with the token issued at login, so only connect
+// once there is one; Login connects after signing in.
+if (sessionToken()) {
+  socket.connect();
+}
+
 socket.on('connect', () => {
   console.log('Connected to Socket.IO server');
 });
 
 socket.on('connect_error', (error) => {
+  if (!socket.active) {
+    // Refused by the server, e.g. "Authentication required" for a missing or
+    // expired session token; it is not retried until Login connects again.
+    console.error('Socket.IO connection refused:', error.message);
+    return;
+  }
   console.error('Socket.IO connection error:', error);
+  // Some proxies refuse WebSocket upgrades; start over with long-polling,
+  // which still upgrades to WebSocket later if it can.
+  socket.io.opts.transports = ['polling', 'websocket'];
 });
 
 socket.on('error', (error) => {